@@ -0,0 +1,148 @@
+"""Vectorised coffee analytics over the full event history.
+
+Timestamps are pulled as int64 epoch seconds and every metric is computed with
+NumPy array operations, so cost stays linear (and small) on years of events.
+"""
+import os
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+import database
+
+# same zone as the bot's quiet hours and dates: DEFAULT_TZ, else the server's (TZ)
+ANALYTICS_TZ = os.getenv("DEFAULT_TZ") or os.getenv("TZ") or "UTC"
+FETCH_BATCH_SIZE = 10000
+TREND_WEEKS = 8
+PEAK_SLOTS = 3
+
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 86400
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+# 1970-01-01 was a Thursday; shift so that Monday == 0
+EPOCH_WEEKDAY = 3
+
+
+def load_event_arrays(tz: str = ANALYTICS_TZ):
+    """
+    Fetch coffee_consumed and set_desire events as parallel NumPy arrays:
+    - ts: UTC epoch seconds (int64, ascending)
+    - local_ts: wall-clock epoch seconds in `tz` (for hour/weekday bucketing)
+    - consumed: True for coffee_consumed, False for set_desire
+    - drink: drink id (int16), unknown drinks count as the default drink
+    """
+    chunks = [
+        np.array(rows, dtype=np.int64)
+        for rows in database.iter_query_batches(
+            '''
+            SELECT EXTRACT(EPOCH FROM created_at)::BIGINT,
+                   EXTRACT(EPOCH FROM created_at AT TIME ZONE %s)::BIGINT,
+                   event_type = 'coffee_consumed',
+                   COALESCE(drink, %s)
+            FROM events
+            WHERE event_type IN ('coffee_consumed', 'set_desire')
+            ORDER BY created_at ASC
+            ''',
+            (tz, database.DRINK_IDS[database.DEFAULT_DRINK]),
+            FETCH_BATCH_SIZE,
+            read_only=True,
+        )
+    ]
+    if chunks:
+        data = np.concatenate(chunks)
+    else:
+        data = np.empty((0, 4), dtype=np.int64)
+    return {
+        "ts": data[:, 0],
+        "local_ts": data[:, 1],
+        "consumed": data[:, 2].astype(bool),
+        "drink": data[:, 3].astype(np.int16),
+    }
+
+
+def gap_percentiles(ts: np.ndarray, percentiles=(25, 50, 75, 90)) -> dict:
+    """Percentiles of gaps (seconds) between consecutive sorted timestamps."""
+    if ts.size < 2:
+        return {p: None for p in percentiles}
+    values = np.percentile(np.diff(ts), percentiles)
+    return {p: int(v) for p, v in zip(percentiles, values)}
+
+
+def weekday_hour_heatmap(local_ts: np.ndarray) -> np.ndarray:
+    """7x24 matrix of event counts (rows Monday..Sunday, columns hour 0..23)."""
+    days, seconds = np.divmod(local_ts, SECONDS_PER_DAY)
+    weekday = (days + EPOCH_WEEKDAY) % 7
+    hour = seconds // SECONDS_PER_HOUR
+    return np.bincount(weekday * 24 + hour, minlength=7 * 24).reshape(7, 24)
+
+
+def peak_slots(heatmap: np.ndarray, limit: int = PEAK_SLOTS) -> list[tuple[int, int, int]]:
+    """Busiest (weekday, hour, count) cells of a heatmap, most active first."""
+    flat = heatmap.ravel()
+    order = np.argsort(flat, kind="stable")[::-1][:limit]
+    return [(int(i // 24), int(i % 24), int(flat[i])) for i in order if flat[i] > 0]
+
+
+def drink_trends(ts: np.ndarray, drink: np.ndarray, now: int, weeks: int = TREND_WEEKS) -> dict:
+    """Per-drink consumption counts for the last `weeks` weeks, oldest week first."""
+    age_weeks = (now - ts) // SECONDS_PER_WEEK
+    recent = (age_weeks >= 0) & (age_weeks < weeks)
+    slot = (weeks - 1) - age_weeks[recent]
+    ids = drink[recent].astype(np.int64)
+    counts = np.bincount(ids * weeks + slot, minlength=(ids.max(initial=0) + 1) * weeks)
+    counts = counts.reshape(-1, weeks)
+    return {
+        database.DRINK_CODES[drink_id]: counts[drink_id].tolist()
+        for drink_id in database.DRINK_CODES
+        if drink_id < counts.shape[0] and counts[drink_id].any()
+    }
+
+
+def predict_next_break(consumed_ts: np.ndarray, gaps: dict, now: int, tz: str = ANALYTICS_TZ):
+    """
+    Next break estimate: last coffee + median gap, window spans the interquartile gaps.
+    Parts of the window already behind `now` are clamped to now; None once it has passed.
+    """
+    if consumed_ts.size < 2 or gaps[50] is None:
+        return None
+    last = int(consumed_ts[-1])
+    window_end = last + gaps[75]
+    if window_end <= now:
+        return None
+    zone = ZoneInfo(tz)
+    return {
+        "at": datetime.fromtimestamp(max(last + gaps[50], now), zone),
+        "window_start": datetime.fromtimestamp(max(last + gaps[25], now), zone),
+        "window_end": datetime.fromtimestamp(window_end, zone),
+    }
+
+
+def compute_analytics(arrays: dict, now: int | None = None, tz: str = ANALYTICS_TZ) -> dict:
+    """Build the analytics report from arrays returned by load_event_arrays."""
+    if now is None:
+        now = int(time.time())
+    consumed = arrays["consumed"]
+    consumed_ts = arrays["ts"][consumed]
+    gaps = gap_percentiles(consumed_ts)
+    consumed_heatmap = weekday_hour_heatmap(arrays["local_ts"][consumed])
+    desire_heatmap = weekday_hour_heatmap(arrays["local_ts"][~consumed])
+    return {
+        "count": int(consumed_ts.size),
+        "desire_count": int(desire_heatmap.sum()),
+        "gap_p50": gaps[50],
+        "gap_p90": gaps[90],
+        "consumed_heatmap": consumed_heatmap,
+        "desire_heatmap": desire_heatmap,
+        "consumed_by_hour": consumed_heatmap.sum(axis=0),
+        "consumed_peaks": peak_slots(consumed_heatmap),
+        "desire_peaks": peak_slots(desire_heatmap),
+        "drink_trends": drink_trends(consumed_ts, arrays["drink"][consumed], now),
+        "next_break": predict_next_break(consumed_ts, gaps, now, tz),
+    }
+
+
+def coffee_analytics() -> dict:
+    """Analytics report over all recorded coffee_consumed and set_desire events."""
+    return compute_analytics(load_event_arrays())
@@ -0,0 +1,261 @@
+"""Micro-benchmarks for the CPU-bound hot functions, checked against a baseline.
+
+Each case runs on synthetic data at several scales (10 / 1k / 100k users or
+events) and records the best per-call time. Without flags the results are
+compared with benchmarks/baseline_hot.json and the script exits non-zero when a
+case is slower than baseline * (1 + tolerance). Each time is the minimum over
+many short repeats, and the suite runs in several fresh worker processes whose
+per-case minimum is kept: timings of small cases shift by tens of percent with
+each process's hash seed and memory layout, so a single process is not enough.
+Cases over the tolerance are timed once more before they count as regressions.
+Cases that take under SMALL_CASE_TIME per call (the 10-element scale and the
+keyboards) swing by more than the default tolerance from run to run, so they
+are held to the looser --small-tolerance.
+
+Baselines are machine-specific and are not committed: the first run on a
+machine records one, and later runs compare with it. Re-record it with --update
+after a deliberate change, and raise --tolerance on noisy shared hosts.
+
+    python benchmarks/bench_hot.py              # compare with the baseline (records it on first run)
+    python benchmarks/bench_hot.py --update     # record a new baseline
+    python benchmarks/bench_hot.py --only gap   # cases whose name contains "gap"
+
+No database or network access is needed.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# bot.py refuses to import without a token; nothing here talks to Telegram
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+
+import bot  # noqa: E402
+import database  # noqa: E402
+from roster import Member  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_hot.json")
+SCALES = (10, 1_000, 100_000)
+DEFAULT_TOLERANCE = 0.25
+SMALL_CASE_TIME = 100e-6  # seconds per call; faster cases use the small-case tolerance
+DEFAULT_SMALL_TOLERANCE = 1.0
+REPEATS = 25
+MIN_REPEAT_TIME = 0.02  # seconds; loops per repeat are scaled up to at least this
+WARMUP_TIME = 1.0  # seconds of busy work before measuring, so the CPU clock settles
+DEFAULT_RUNS = 3  # worker processes per invocation
+SEED = 1234
+
+
+def synthetic_timestamps(n, rng):
+    """Unsorted coffee_consumed timestamps spread over a year."""
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [start + timedelta(seconds=rng.randrange(365 * 86400)) for _ in range(n)]
+
+
+def synthetic_members(n, rng):
+    drinks = list(database.DRINK_IDS)
+    return [Member(i, f"user{i}", rng.randrange(11), rng.choice(drinks)) for i in range(n)]
+
+
+def synthetic_stat_rows(n_users, rng):
+    """GROUP BY rows as user_weekly_stats receives them: a few per user."""
+    rows = []
+    for user_id in range(n_users):
+        username = f"user{user_id}"
+        rows.append({"user_id": user_id, "username": username, "event_type": "set_desire",
+                     "drink": None, "cnt": rng.randrange(1, 30)})
+        for drink_id in rng.sample(list(database.DRINK_CODES), 2):
+            for event_type in ("set_drink", "coffee_consumed"):
+                rows.append({"user_id": user_id, "username": username, "event_type": event_type,
+                             "drink": drink_id, "cnt": rng.randrange(1, 10)})
+    rng.shuffle(rows)
+    return rows
+
+
+def synthetic_drink_counts(n, rng):
+    """One drink-count dict per user, as the per-user report formats them."""
+    drinks = list(database.DRINK_IDS)
+    return [{code: rng.randrange(1, 20) for code in rng.sample(drinks, rng.randrange(1, 5))} for _ in range(n)]
+
+
+def cases():
+    """(name, scale label, setup -> zero-argument callable) for every benchmark case."""
+    for n in SCALES:
+        yield "compute_gap_stats", n, lambda rng, n=n: (
+            lambda data=synthetic_timestamps(n, rng): database.compute_gap_stats(data)
+        )
+        yield "fold_user_stats", n, lambda rng, n=n: (
+            lambda rows=synthetic_stat_rows(n, rng): database.fold_user_stats(rows)
+        )
+        yield "build_status_text", n, lambda rng, n=n: (
+            lambda members=synthetic_members(n, rng): bot.build_status_text(members, 7)
+        )
+        yield "format_drink_counts", n, lambda rng, n=n: (
+            lambda counts=synthetic_drink_counts(n, rng): [bot.format_drink_counts(c) for c in counts]
+        )
+    # keyboards are lru_cached; a cache hit (~50 ns) is below the timer noise, so
+    # only a fresh build is measured
+    for builder in ("level_keyboard", "drink_keyboard", "main_menu"):
+        yield f"{builder}", "build", lambda rng, b=builder: getattr(bot, b).__wrapped__
+
+
+def measure(call):
+    """Best per-call time in seconds over REPEATS repeats; GC is off while timing, as in timeit."""
+    gc.collect()
+    gc.disable()
+    try:
+        return _measure(call)
+    finally:
+        gc.enable()
+
+
+def _measure(call):
+    call()  # warm caches before timing
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            call()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_REPEAT_TIME or loops >= 1 << 20:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(MIN_REPEAT_TIME / elapsed) + 1)
+    best = elapsed / loops
+    for _ in range(REPEATS - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            call()
+        best = min(best, (time.perf_counter() - started) / loops)
+    return best
+
+
+def format_time(seconds):
+    for unit, factor in (("s", 1), ("ms", 1e3), ("µs", 1e6)):
+        if seconds * factor >= 1:
+            return f"{seconds * factor:8.2f} {unit}"
+    return f"{seconds * 1e9:8.1f} ns"
+
+
+def warm_up(seconds=WARMUP_TIME):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        "\n".join(f"{i}:{i * i}" for i in range(1000))
+
+
+def run(only=None):
+    """Time every selected case in this process; returns {case: seconds}."""
+    warm_up()
+    results = {}
+    for name, scale, setup in cases():
+        key = f"{name}[{scale}]"
+        if only and only not in key:
+            continue
+        call = setup(random.Random(SEED))
+        results[key] = measure(call)
+    return results
+
+
+def run_workers(runs, only=None):
+    """Best time per case over `runs` fresh worker processes."""
+    command = [sys.executable, os.path.abspath(__file__), "--worker"]
+    if only:
+        command += ["--only", only]
+    best = {}
+    for _ in range(runs):
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        for key, seconds in json.loads(output).items():
+            best[key] = min(seconds, best.get(key, seconds))
+    for key, seconds in best.items():
+        print(f"{key:<34} {format_time(seconds)}")
+    return best
+
+
+def compare(results, baseline, tolerance, small_tolerance):
+    """Print the ratio to the baseline per case; returns the keys that regressed."""
+    regressions = []
+    print(f"\nvs baseline (tolerance {tolerance:.0%}, {small_tolerance:.0%} under {format_time(SMALL_CASE_TIME).strip()}):")
+    for key, seconds in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            print(f"  {key:<34} new case, no baseline")
+            continue
+        ratio = seconds / reference
+        allowed = small_tolerance if reference < SMALL_CASE_TIME else tolerance
+        flag = ""
+        if ratio > 1 + allowed:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"  {key:<34} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def write_baseline(results, merge):
+    """Store results as the baseline; with merge, cases not in results keep their recorded times."""
+    baseline = {}
+    if merge and os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)["results"]
+    baseline.update(results)
+    with open(BASELINE_PATH, "w") as f:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "results": dict(sorted(baseline.items())),
+            },
+            f,
+            indent=2,
+        )
+        f.write("\n")
+    print(f"\nbaseline written to {os.path.relpath(BASELINE_PATH, ROOT)}")
+
+
+def main(args):
+    if args.worker:
+        json.dump(run(args.only), sys.stdout)
+        return 0
+    results = run_workers(args.runs, args.only)
+    if args.update or not os.path.exists(BASELINE_PATH):
+        # the first run on a machine becomes its baseline
+        write_baseline(results, merge=bool(args.only))
+        return 0
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance, args.small_tolerance)
+    if regressions:
+        # a slow outlier process is far more common than a real regression:
+        # time the flagged cases again and keep the better result
+        print(f"\nre-measuring {len(regressions)} case(s)")
+        for key in regressions:
+            again = run_workers(args.runs, key)
+            results[key] = min(results[key], again[key])
+        regressions = compare(
+            {key: results[key] for key in regressions}, baseline, args.tolerance, args.small_tolerance
+        )
+    if regressions:
+        print(f"\n{len(regressions)} case(s) regressed beyond their tolerance")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="record the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown before failing, e.g. 0.25 = 25%%")
+    parser.add_argument("--small-tolerance", type=float, default=DEFAULT_SMALL_TOLERANCE,
+                        help="allowed slowdown for cases faster than 100 µs per call")
+    parser.add_argument("--only", help="run only cases whose name contains this string")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS,
+                        help="worker processes to take the best time from")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    sys.exit(main(parser.parse_args()))
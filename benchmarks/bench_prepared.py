@@ -0,0 +1,117 @@
+"""Hot-query latency benchmark: plain SQL vs prepared statements.
+
+Runs the queries behind user_exists, set_desire, log_event and get_setting
+against the database configured by the DB_* env vars, three ways:
+
+- a new connection per call (how database.py used to work)
+- a pooled connection with plain SQL (parsed and planned on every call)
+- a pooled connection with the named prepared statements (EXECUTE)
+
+    python benchmarks/bench_prepared.py --iterations 2000
+
+set_desire targets a user id that does not exist, and the benchmark's own events
+are deleted at the end, so it is safe to point at a development database.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+BENCH_USER_ID = -424242
+BENCH_EVENT_TYPE = "bench_prepared"
+
+PLAIN_SQL = {
+    "user_exists": ("SELECT 1 FROM users WHERE user_id = %s", (BENCH_USER_ID,)),
+    "set_desire": ("UPDATE users SET desire = %s WHERE user_id = %s", (5, BENCH_USER_ID)),
+    "log_event": (
+        """
+        INSERT INTO events (event_type, user_id, username, info, level, drink, invite_code, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, COALESCE(%s, NOW()))
+        """,
+        (BENCH_EVENT_TYPE, BENCH_USER_ID, "bench", None, 5, 1, None, None),
+    ),
+    "get_setting": ("SELECT value FROM settings WHERE key = %s", ("threshold",)),
+}
+
+
+def timed(call, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def connection_per_call(name):
+    sql, params = PLAIN_SQL[name]
+
+    def call():
+        conn = database.connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+        finally:
+            conn.close()
+    return call
+
+
+def pooled_plain(name):
+    sql, params = PLAIN_SQL[name]
+
+    def call():
+        with database.get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(sql, params)
+    return call
+
+
+def pooled_prepared(name):
+    _, params = PLAIN_SQL[name]
+
+    def call():
+        with database.get_connection() as conn, conn.cursor() as cursor:
+            database.execute_prepared(cursor, name, params)
+    return call
+
+
+def report(label, samples):
+    mean = statistics.fmean(samples) * 1e6
+    p50 = statistics.median(samples) * 1e6
+    p99 = sorted(samples)[int(len(samples) * 0.99) - 1] * 1e6
+    print(f"  {label:<24} mean {mean:8.1f} µs  p50 {p50:8.1f} µs  p99 {p99:8.1f} µs")
+    return mean
+
+
+def main(args):
+    variants = [
+        ("connection per call", connection_per_call, max(args.iterations // 10, 1)),
+        ("pooled, plain SQL", pooled_plain, args.iterations),
+        ("pooled, prepared", pooled_prepared, args.iterations),
+    ]
+    print(f"{args.iterations} iterations per query ({variants[0][2]} for connection per call)")
+    try:
+        for name in PLAIN_SQL:
+            print(name)
+            means = {}
+            for label, make, iterations in variants:
+                call = make(name)
+                timed(call, args.warmup)
+                means[label] = report(label, timed(call, iterations))
+            saved = means["pooled, plain SQL"] - means["pooled, prepared"]
+            print(f"  parse/plan saved per call: {saved:.1f} µs "
+                  f"({saved * 100 / means['pooled, plain SQL']:.0f}%)")
+    finally:
+        with database.get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("DELETE FROM events WHERE event_type = %s", (BENCH_EVENT_TYPE,))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=50)
+    main(parser.parse_args())
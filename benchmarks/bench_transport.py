@@ -0,0 +1,123 @@
+"""Bot API throughput benchmark against a local fake Bot API server.
+
+Compares the stock aiogram session with sequential sends (how broadcasts used to
+run) against the tuned transport.build_session() with bounded-concurrency sends.
+
+    python benchmarks/bench_transport.py --messages 2000 --latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+import transport  # noqa: E402
+
+TOKEN = "123456:BENCHMARK"
+
+
+def fake_api_app(latency: float) -> web.Application:
+    """Answers sendMessage like the Bot API after `latency` seconds."""
+    counter = 0
+
+    async def send_message(request: web.Request):
+        nonlocal counter
+        form = await request.post()
+        if latency:
+            await asyncio.sleep(latency)
+        counter += 1
+        chat_id = int(form["chat_id"])
+        return web.json_response(
+            {
+                "ok": True,
+                "result": {
+                    "message_id": counter,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": form.get("text", ""),
+                },
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post(f"/bot{TOKEN}/sendMessage", send_message)
+    return app
+
+
+async def run_variant(name, session, messages, concurrency):
+    bot = Bot(token=TOKEN, session=session)
+    payload = "☕ ВРЕМЯ КОФЕ! ☕\n" + "- участник: 9/10 (Кофе)\n" * 10
+    try:
+        # warm-up so connection setup is not part of the measurement
+        await bot.send_message(1, "warm-up")
+        started = time.perf_counter()
+        if concurrency <= 1:
+            for i in range(messages):
+                await bot.send_message(i + 1, payload)
+        else:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def send(i):
+                async with semaphore:
+                    await bot.send_message(i + 1, payload)
+
+            await asyncio.gather(*(send(i) for i in range(messages)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+    rate = messages / elapsed
+    print(f"{name:<40} {elapsed:8.2f} s  {rate:10.1f} msg/s")
+    return rate
+
+
+async def main(args):
+    runner = web.AppRunner(fake_api_app(args.latency))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+    api = TelegramAPIServer.from_base(base_url)
+    print(
+        f"{args.messages} messages, fake API latency {args.latency * 1000:.0f} ms, "
+        f"concurrency {args.concurrency}, loop {type(asyncio.get_running_loop()).__module__}"
+    )
+    try:
+        baseline = await run_variant(
+            "default session, sequential", AiohttpSession(api=api), args.messages, 1
+        )
+        await run_variant(
+            "default session, concurrent",
+            AiohttpSession(api=api),
+            args.messages,
+            args.concurrency,
+        )
+        tuned = await run_variant(
+            "tuned session, concurrent",
+            transport.build_session(limit=args.concurrency, api_base=base_url),
+            args.messages,
+            args.concurrency,
+        )
+        print(f"speed-up vs sequential default: {tuned / baseline:.1f}x")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API latency, seconds")
+    parser.add_argument("--concurrency", type=int, default=transport.BROADCAST_CONCURRENCY)
+    parser.add_argument("--no-uvloop", action="store_true")
+    args = parser.parse_args()
+    if not args.no_uvloop:
+        transport.install_event_loop_policy()
+    asyncio.run(main(args))
@@ -0,0 +1,415 @@
+"""Query-plan regression check for every query in database.py.
+
+Seeds a scratch Postgres database with production-like volumes (by default 10k
+users, 2M events over two years and 100k invites), then calls each database.py
+query function with sample arguments on a connection that runs every statement
+under `EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)` before running it for real. Each
+call is rolled back afterwards, so writes leave the seed data untouched.
+
+For every function the plan shape (node types with their tables and indexes),
+planning/execution time and buffer counts are printed. The check fails when
+
+- a plan contains a Seq Scan, except on SMALL_TABLES and where SEQ_SCAN_OK
+  allows it for that function (reports that read a whole table on purpose), or
+- a plan shape differs from benchmarks/baseline_plans.json.
+
+Timings are informational: they depend on the machine and the cache state.
+
+    python benchmarks/query_plans.py              # compare with the baseline
+    python benchmarks/query_plans.py --update     # record a new baseline
+    python benchmarks/query_plans.py --reseed --events 5000000
+
+The DB_* env vars select the server; the scratch database (--dbname, default
+coffee_plans) is created there if it does not exist and is reused between runs
+as long as it was seeded with the same volumes.
+"""
+import argparse
+import json
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import analytics  # noqa: E402
+import database  # noqa: E402
+import migrations  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_plans.json")
+DEFAULT_DBNAME = "coffee_plans"
+DEFAULT_USERS = 10_000
+DEFAULT_EVENTS = 2_000_000
+DEFAULT_INVITES = 100_000
+HISTORY_DAYS = 730
+SEED_MARKER = "query_plans_seed"  # settings key holding the seeded volumes
+FIRST_USER_ID = 100_000_000
+ADMIN_ID = FIRST_USER_ID
+EXPLAIN = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+# node names as in text EXPLAIN output
+AGGREGATE_NODES = {"Sorted": "GroupAggregate", "Hashed": "HashAggregate", "Mixed": "MixedAggregate"}
+
+# tiny tables where a Seq Scan is the cheapest plan for any query
+SMALL_TABLES = {"settings"}
+# tables a function may scan sequentially because it reads (nearly) all of it
+SEQ_SCAN_OK = {
+    "get_all_users": {"users"},
+    "reset_desires": {"users"},
+    "get_all_coffee_events": {"events"},
+    "analytics.load_event_arrays": {"events"},
+}
+
+
+def seed_user(n):
+    return FIRST_USER_ID + n
+
+
+def samples():
+    """(label, zero-argument call) for every query function, with seed-data arguments."""
+    user_id = seed_user(42)
+    now = datetime.now(timezone.utc)
+    return [
+        ("add_user", lambda: database.add_user(user_id, "user42")),
+        ("set_desire", lambda: database.set_desire(user_id, 5)),
+        ("get_all_users", database.get_all_users),
+        ("reset_desires", database.reset_desires),
+        ("get_user", lambda: database.get_user(user_id)),
+        ("user_exists", lambda: database.user_exists(user_id)),
+        ("log_event", lambda: database.log_event(
+            "coffee_consumed", user_id, "user42", drink="latte", created_at=now)),
+        ("create_invite", lambda: database.create_invite("plans-new", ADMIN_ID)),
+        ("create_invites", lambda: database.create_invites(
+            [f"plans-bulk-{i}" for i in range(50)], ADMIN_ID, now + timedelta(hours=24))),
+        ("consume_invite", lambda: database.consume_invite("seed-live-1", user_id, "user42")),
+        ("expire_invites", database.expire_invites),
+        ("get_coffee_events_since", lambda: list(database.get_coffee_events_since(7))),
+        ("get_all_coffee_events", lambda: list(database.get_all_coffee_events())),
+        ("get_setting", lambda: database.get_setting("threshold")),
+        ("set_setting", lambda: database.set_setting("threshold", 7)),
+        ("set_user_timezone", lambda: database.set_user_timezone(user_id, "Europe/Moscow")),
+        ("set_user_quiet_hours", lambda: database.set_user_quiet_hours(user_id, 22, 8)),
+        ("set_desire_type", lambda: database.set_desire_type(user_id, "latte")),
+        ("get_desire_type", lambda: database.get_desire_type(user_id)),
+        ("user_weekly_stats", lambda: database.user_weekly_stats(7)),
+        ("analytics.load_event_arrays", analytics.load_event_arrays),
+    ]
+
+
+# -------- Seeding --------
+
+def ensure_database(dbname):
+    """Create the scratch database through the server's maintenance database."""
+    conn = psycopg2.connect(
+        host=database.DB_HOST, port=database.DB_PORT, dbname="postgres",
+        user=database.DB_USER, password=database.DB_PASSWORD,
+    )
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
+            if cursor.fetchone() is None:
+                print(f"creating database {dbname}")
+                cursor.execute(f'CREATE DATABASE "{dbname}"')
+    finally:
+        conn.close()
+
+
+def seed(users, events, invites, reseed=False):
+    """Fill the scratch database unless it already holds the same volumes."""
+    marker = f"{users}/{events}/{invites}"
+    conn = database.connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT value FROM settings WHERE key = %s", (SEED_MARKER,))
+            row = cursor.fetchone()
+            if row and row["value"] == marker and not reseed:
+                return
+            print(f"seeding {users} users, {events} events, {invites} invites")
+            conn.autocommit = False
+            cursor.execute("TRUNCATE users, events, invites")
+            # same data, and so the same statistics and plans, on every reseed
+            cursor.execute("SELECT setseed(0.5)")
+            cursor.execute(
+                """
+                INSERT INTO users (user_id, username, desire, desire_type, tz, quiet_start, quiet_end, created_at)
+                SELECT %(first)s + g, 'user' || g, (random() * 10)::INT,
+                       (ARRAY['coffee', 'latte', 'milk', 'espresso'])[1 + (random() * 3)::INT],
+                       CASE WHEN g %% 4 = 0 THEN 'Europe/Moscow' END,
+                       CASE WHEN g %% 8 = 0 THEN 23 END,
+                       CASE WHEN g %% 8 = 0 THEN 7 END,
+                       NOW() - random() * INTERVAL '%(days)s days'
+                FROM generate_series(0, %(users)s - 1) AS g
+                """,
+                {"first": FIRST_USER_ID, "users": users, "days": HISTORY_DAYS},
+            )
+            # mostly used or expired, a few still live; seed-live-N never expire
+            cursor.execute(
+                """
+                INSERT INTO invites (code, created_by, created_at, used_by, used_at, active, expires_at)
+                SELECT code, %(admin)s, created_at,
+                       CASE WHEN kind = 'used' THEN %(first)s + (random() * (%(users)s - 1))::INT END,
+                       CASE WHEN kind = 'used' THEN created_at + INTERVAL '1 hour' END,
+                       kind IN ('live', 'expired'),
+                       CASE kind WHEN 'expired' THEN created_at + INTERVAL '24 hours'
+                                 WHEN 'used' THEN created_at + INTERVAL '24 hours' END
+                FROM (
+                    SELECT CASE WHEN g %% 20 = 0 THEN 'seed-live-' || g / 20 ELSE 'seed-' || g END AS code,
+                           CASE WHEN g %% 20 = 0 THEN 'live'
+                                WHEN g %% 20 = 1 THEN 'expired'
+                                WHEN g %% 20 = 2 THEN 'revoked'
+                                ELSE 'used' END AS kind,
+                           NOW() - random() * INTERVAL '%(days)s days' AS created_at
+                    FROM generate_series(0, %(invites)s - 1) AS g
+                ) AS i
+                """,
+                {"admin": ADMIN_ID, "first": FIRST_USER_ID, "users": users,
+                 "invites": invites, "days": HISTORY_DAYS},
+            )
+            # event mix roughly as the bot writes it; ids follow created_at
+            cursor.execute(
+                """
+                INSERT INTO events (event_type, user_id, username, info, level, drink, created_at)
+                SELECT event_type, %(first)s + u, 'user' || u,
+                       CASE WHEN event_type = 'set_desire' AND r < 0.1 THEN 'adjust' END,
+                       CASE WHEN event_type = 'set_desire' THEN (r * 100)::INT %% 11 END,
+                       CASE WHEN event_type IN ('set_drink', 'coffee_consumed') THEN 1 + (r * 100)::INT %% 4 END,
+                       NOW() - INTERVAL '%(days)s days' * (1 - g::FLOAT8 / %(events)s)
+                FROM (
+                    SELECT g, random() AS r, (random() * (%(users)s - 1))::INT AS u,
+                           CASE WHEN g %% 20 < 9 THEN 'set_desire'
+                                WHEN g %% 20 < 14 THEN 'set_drink'
+                                WHEN g %% 20 < 19 THEN 'coffee_consumed'
+                                ELSE 'start' END AS event_type
+                    FROM generate_series(1, %(events)s) AS g
+                ) AS e
+                """,
+                {"first": FIRST_USER_ID, "users": users, "events": events, "days": HISTORY_DAYS},
+            )
+            cursor.execute(
+                """
+                INSERT INTO settings (key, value) VALUES (%s, %s)
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+                """,
+                (SEED_MARKER, marker),
+            )
+            conn.commit()
+            conn.autocommit = True
+            cursor.execute("VACUUM ANALYZE")
+    finally:
+        conn.close()
+
+
+# -------- Plan capture --------
+
+class ExplainCursor(psycopg2.extensions.cursor):
+    """Explains each statement inside a savepoint, then runs it for real."""
+
+    def execute(self, query, vars=None):
+        sql = self.mogrify(query, vars).decode()
+        if not sql.lstrip().upper().startswith("PREPARE"):
+            # the real statement must see the same rows the explained one did
+            with self.connection.plain_cursor() as explain:
+                explain.execute("SAVEPOINT explain")
+                explain.execute(EXPLAIN + sql)
+                self.connection.plans.append(explain.fetchone()[0][0])
+                explain.execute("ROLLBACK TO SAVEPOINT explain")
+        return super().execute(query, vars)
+
+
+class ExplainDictCursor(ExplainCursor, psycopg2.extras.RealDictCursor):
+    pass
+
+
+class ExplainConnection(database.PreparedConnection):
+    """
+    One connection shared by every database.py entry point while plans are
+    captured. Cursors are always client-side (EXPLAIN cannot run through DECLARE),
+    and the transaction, session settings and close() belong to the caller.
+    """
+
+    plans = None
+
+    def cursor(self, name=None, cursor_factory=None, **kwargs):
+        if issubclass(cursor_factory or self.cursor_factory, psycopg2.extras.RealDictCursor):
+            return super().cursor(cursor_factory=ExplainDictCursor)
+        return super().cursor(cursor_factory=ExplainCursor)
+
+    def plain_cursor(self):
+        """A cursor that is not explained, for the capture's own statements."""
+        return super().cursor(cursor_factory=psycopg2.extensions.cursor)
+
+    def set_session(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+    def really_close(self):
+        super().close()
+
+
+@contextmanager
+def capturing(conn):
+    """Route database.py's connections to `conn` and roll back everything it did."""
+    patched = {
+        "connect": lambda *args, **kwargs: conn,
+        "get_read_connection": lambda: conn,
+        "get_connection": contextmanager(lambda: (yield conn)),
+    }
+    saved = {name: getattr(database, name) for name in patched}
+    for name, replacement in patched.items():
+        setattr(database, name, replacement)
+    conn.plans = []
+    with conn.plain_cursor() as cursor:
+        # psycopg2 stays in autocommit mode, so its own rollback() calls are no-ops
+        cursor.execute("BEGIN")
+    try:
+        yield conn.plans
+    finally:
+        with conn.plain_cursor() as cursor:
+            cursor.execute("ROLLBACK")
+        for name, original in saved.items():
+            setattr(database, name, original)
+
+
+def plan_shape(node, depth=0):
+    """Pre-order list of 'Node Type on relation using index' lines, indented by depth."""
+    label = node["Node Type"]
+    if label == "Aggregate":
+        label = AGGREGATE_NODES.get(node.get("Strategy"), label)
+    elif label == "ModifyTable":
+        label = node["Operation"]
+    if "Relation Name" in node:
+        label += f" on {node['Relation Name']}"
+    if "Index Name" in node:
+        label += f" using {node['Index Name']}"
+    lines = ["  " * depth + label]
+    for child in node.get("Plans", ()):
+        lines += plan_shape(child, depth + 1)
+    return lines
+
+
+def seq_scans(node):
+    """Relations read by Seq Scan nodes anywhere in the plan."""
+    found = {node["Relation Name"]} if node["Node Type"] == "Seq Scan" else set()
+    for child in node.get("Plans", ()):
+        found |= seq_scans(child)
+    return found
+
+
+def capture(conn, call):
+    with capturing(conn) as plans:
+        call()
+    # a loop such as the invite sweep repeats one statement a data-dependent
+    # number of times; each distinct plan counts once
+    shapes = []
+    for plan in plans:
+        shape = plan_shape(plan["Plan"])
+        if shape not in shapes:
+            shapes.append(shape)
+    return {
+        "statements": len(plans),
+        "shape": shapes,
+        "seq_scans": sorted(set().union(*(seq_scans(plan["Plan"]) for plan in plans))),
+        "planning_ms": round(sum(plan["Planning Time"] for plan in plans), 3),
+        "execution_ms": round(sum(plan["Execution Time"] for plan in plans), 3),
+        "shared_hit": sum(plan["Plan"].get("Shared Hit Blocks", 0) for plan in plans),
+        "shared_read": sum(plan["Plan"].get("Shared Read Blocks", 0) for plan in plans),
+    }
+
+
+# -------- Report --------
+
+def check(results, baseline):
+    """Print each function's plans and flags; returns the number of problems found."""
+    problems = 0
+    for label, result in results.items():
+        print(
+            f"\n{label}: {result['statements']} statement(s), planning {result['planning_ms']:.2f} ms, "
+            f"execution {result['execution_ms']:.2f} ms, buffers hit {result['shared_hit']} "
+            f"read {result['shared_read']}"
+        )
+        for shape in result["shape"]:
+            for line in shape:
+                print(f"    {line}")
+        unexpected = set(result["seq_scans"]) - SEQ_SCAN_OK.get(label, set()) - SMALL_TABLES
+        if unexpected:
+            problems += 1
+            print(f"  SEQ SCAN on {', '.join(sorted(unexpected))}")
+        if baseline is None:
+            continue
+        if label not in baseline:
+            print("  new function, no baseline")
+        elif baseline[label]["shape"] != result["shape"]:
+            problems += 1
+            print("  PLAN CHANGED, baseline was:")
+            for shape in baseline[label]["shape"]:
+                for line in shape:
+                    print(f"    {line}")
+    return problems
+
+
+def main(args):
+    database.DB_NAME = args.dbname
+    ensure_database(args.dbname)
+    migrations.migrate()
+    seed(args.users, args.events, args.invites, args.reseed)
+
+    conn = database.connect(connection_factory=ExplainConnection)
+    try:
+        results = {}
+        for label, call in samples():
+            if args.only and args.only not in label:
+                continue
+            results[label] = capture(conn, call)
+    finally:
+        conn.really_close()
+
+    if args.update:
+        check(results, None)
+        baseline = {}
+        if args.only and os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                baseline = json.load(f)["functions"]
+        baseline.update(results)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(
+                {
+                    "seed": {"users": args.users, "events": args.events, "invites": args.invites},
+                    "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                    "functions": dict(sorted(baseline.items())),
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+        print(f"\nbaseline written to {os.path.relpath(BASELINE_PATH, ROOT)}")
+        return 0
+    baseline = None
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)["functions"]
+    else:
+        print("no baseline yet; record one with --update")
+    problems = check(results, baseline)
+    if problems:
+        print(f"\n{problems} problem(s) found")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="record the plans as the new baseline")
+    parser.add_argument("--only", help="check only functions whose name contains this string")
+    parser.add_argument("--dbname", default=DEFAULT_DBNAME, help="scratch database to seed and query")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS)
+    parser.add_argument("--events", type=int, default=DEFAULT_EVENTS)
+    parser.add_argument("--invites", type=int, default=DEFAULT_INVITES)
+    parser.add_argument("--reseed", action="store_true", help="reseed even if the volumes match")
+    sys.exit(main(parser.parse_args()))
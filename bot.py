@@ -1,20 +1,38 @@
 import asyncio
+import hashlib
+import html
 import os
 import logging
 import random
 import secrets
-from datetime import datetime
+import tempfile
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.filters import Command, ExceptionTypeFilter
+from aiogram.types import BufferedInputFile, ErrorEvent, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
+import analytics
 import database
+import deferred
+import export
+import loop_watchdog
+import profiler
+import stats_cache
+import transport
+from roster import Roster
+from user_queues import UserQueues
 
 # Load environment variables
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DEFAULT_INVITE_CODE = os.getenv("DEFAULT_INVITE_CODE")
 MESSAGE_TTL = int(os.getenv("MESSAGE_TTL", "3600"))
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+STATUS_BOARD_MIN_INTERVAL = float(os.getenv("STATUS_BOARD_MIN_INTERVAL", "3"))
+INVITE_TTL_HOURS = float(os.getenv("INVITE_TTL_HOURS", "72"))  # 0 = invites never expire
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,13 +42,22 @@ if not BOT_TOKEN:
     print("Error: BOT_TOKEN not found in .env file.")
     exit(1)
 
-bot = Bot(token=BOT_TOKEN)
+bot = Bot(token=BOT_TOKEN, session=transport.build_session())
 dp = Dispatcher()
+roster = Roster()
+deferred_queue = deferred.DeferredQueue()
+user_queues = UserQueues()
 
 DESIRE_THRESHOLD = 5  # fallback, overridden by settings
 PROMPT_INTERVAL_SECONDS = 3600  # fallback for reminders
-QUIET_HOURS_START = 0
-QUIET_HOURS_END = 8
+QUIET_HOURS_START = int(os.getenv("QUIET_HOURS_START", "0"))  # default window, local hours
+QUIET_HOURS_END = int(os.getenv("QUIET_HOURS_END", "8"))
+DEFAULT_TZ = os.getenv("DEFAULT_TZ")  # None: the server's local time
+MAX_BULK_INVITES = 50
+INVITE_CODE_ATTEMPTS = 3  # /invites batches generated before reporting a shortfall
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024  # Bot API upload limit
+INVITE_SWEEP_INTERVAL = 3600  # seconds between sweeps of expired invites
+WRITE_REPLAY_INTERVAL = 5  # seconds between attempts to replay writes queued during a DB outage
 PEER_NOTIFY_COOLDOWN = 1800  # seconds
 MOTIVATION_COOLDOWN = 1200   # seconds
 DRINK_OPTIONS = {
@@ -39,12 +66,24 @@ DRINK_OPTIONS = {
     "milk": "Только молоко",
     "espresso": "Эспрессо",
 }
+WEEKDAY_LABELS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+SPARK_BARS = "▁▂▃▄▅▆▇█"
 
 # rate-limit state (in-memory)
 peer_notify_last = {}
 motivation_last_at = 0
 last_temp_message = {}
 last_system_message = {}
+# live status boards: chat_id -> message_id of the board edited in place
+status_boards = {}
+status_board_hashes = {}
+status_board_text = None
+status_board_roster = None  # roster.loaded_at the cached board text was rendered from
+status_board_dirty = False
+status_board_last_edit = 0.0
+status_board_task = None
+# the single pool announcement in the bound group chat, edited in place
+group_announcement = {"chat_id": None, "message_id": None, "kind": None}
 MOTIVATION_MESSAGES = [
     "Кофе ждёт вас! Заряд бодрости уже на подходе.",
     "Лучшие решения приходят с чашкой кофе. Вперёд!",
@@ -54,6 +93,36 @@ MOTIVATION_MESSAGES = [
 ]
 
 
+def handler_label(event) -> str:
+    """Short handler name for watchdog reports: callback data prefix or command."""
+    if isinstance(event, types.CallbackQuery):
+        return "callback:" + (event.data or "").split(":", 1)[0]
+    text = getattr(event, "text", None) or ""
+    if text.startswith("/"):
+        return "message:" + text.split()[0]
+    return "message:text"
+
+
+@dp.update.outer_middleware()
+async def serialize_per_user(handler, event, data):
+    """A user's updates run one at a time in arrival order; different users run in parallel."""
+    user = data.get("event_from_user")
+    return await user_queues.run(user.id if user else None, lambda: handler(event, data))
+
+
+@dp.message.outer_middleware()
+@dp.callback_query.outer_middleware()
+async def watch_handler(handler, event, data):
+    with loop_watchdog.track(handler_label(event)):
+        return await handler(event, data)
+
+
+# Keyboards below are static (or depend only on their arguments), so each one is
+# built once and the same markup object is reused by every handler and broadcast.
+# Treat the returned markups as read-only.
+
+
+@lru_cache(maxsize=None)
 def main_menu() -> InlineKeyboardMarkup:
     """Primary inline menu for all interactions."""
     return InlineKeyboardMarkup(
@@ -64,6 +133,7 @@ def main_menu() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def level_keyboard() -> InlineKeyboardMarkup:
     """Inline keyboard with levels 0-10 plus back button."""
     rows = [
@@ -82,22 +152,21 @@ def level_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def build_status_text(users: list[dict]) -> str:
-    threshold = current_threshold()
-    text = "Текущий статус желания кофе:\n"
-    for u in users:
-        status_icon = "🟢" if u["desire"] >= threshold else "🔴"
-        drink_part = ""
-        if u["desire"] >= threshold:
-            drink_part = f" ({drink_label(u.get('desire_type'))})"
-        text += f"{status_icon} {u['username']}: {u['desire']}/10{drink_part}\n"
-    return text
+def build_status_text(members, threshold: int) -> str:
+    lines = ["Текущий статус желания кофе:"]
+    for m in members:
+        if m.desire >= threshold:
+            lines.append(f"🟢 {m.username}: {m.desire}/10 ({drink_label(m.desire_type)})")
+        else:
+            lines.append(f"🔴 {m.username}: {m.desire}/10")
+    return "\n".join(lines) + "\n"
 
 
 def drink_label(code: str | None) -> str:
     return DRINK_OPTIONS.get(code or "coffee", "Кофе")
 
 
+@lru_cache(maxsize=None)
 def drink_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -114,6 +183,64 @@ def drink_keyboard() -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
+def reset_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text="✅ Кофе выпито", callback_data="reset")]]
+    )
+
+
+@lru_cache(maxsize=None)
+def settings_keyboard(admin: bool = False) -> InlineKeyboardMarkup:
+    rows = [
+        [
+            InlineKeyboardButton(text="📊 Статус", callback_data="status"),
+            InlineKeyboardButton(text="✅ Кофе выпито", callback_data="reset"),
+        ],
+        [InlineKeyboardButton(text="🥤 Напиток", callback_data="drink_menu")],
+        [
+            InlineKeyboardButton(text="📈 7 дней", callback_data="weekly_stats"),
+            InlineKeyboardButton(text="👤 7д по людям", callback_data="weekly_user_stats"),
+        ],
+        [
+            InlineKeyboardButton(text="📊 Всё время", callback_data="all_stats"),
+            InlineKeyboardButton(text="🔥 Аналитика", callback_data="analytics"),
+        ],
+        [InlineKeyboardButton(text="🔑 Пригласить", callback_data="invite")],
+        [
+            InlineKeyboardButton(text="Порог -1", callback_data="set_threshold:-1"),
+            InlineKeyboardButton(text="Порог +1", callback_data="set_threshold:+1"),
+        ],
+        [
+            InlineKeyboardButton(text="Интервал 30м", callback_data="set_interval:1800"),
+            InlineKeyboardButton(text="Интервал 60м", callback_data="set_interval:3600"),
+            InlineKeyboardButton(text="Интервал 90м", callback_data="set_interval:5400"),
+        ],
+    ]
+    if admin:
+        rows.append(
+            [
+                InlineKeyboardButton(text="🔬 Профиль 15с", callback_data="profile:15"),
+                InlineKeyboardButton(text="🔬 Профиль 60с", callback_data="profile:60"),
+                InlineKeyboardButton(text="🐢 Зависания", callback_data="stalls"),
+            ]
+        )
+    rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@lru_cache(maxsize=64)
+def settings_text(threshold: int, interval: int, quiet: str) -> str:
+    return (
+        "⚙️ Настройки\n"
+        f"• Порог готовности: {threshold}\n"
+        f"• Интервал напоминаний: {interval // 60} мин\n"
+        f"• Тихие часы: {quiet}\n"
+        "  Изменить: /quiet 23 7, часовой пояс: /tz Europe/Moscow\n"
+        "• Общие объявления в группу (админы): /bindgroup в групповом чате, /unbindgroup — вернуть ЛС\n"
+    )
+
+
 def schedule_auto_delete(message: types.Message):
     if message is None:
         return
@@ -164,6 +291,9 @@ async def send_temp(chat_id: int, text: str, reply_markup=None, allow_multiple:
 async def delete_message_safe(message: types.Message | None):
     if not message:
         return
+    if status_boards.get(message.chat.id) == message.message_id:
+        # menu buttons on the live board must not delete the board itself
+        return
     try:
         await message.delete()
     except Exception:
@@ -179,6 +309,111 @@ async def delete_message_by_id(chat_id: int, message_id: int | None):
         pass
 
 
+async def broadcast(members, send, action: str):
+    """
+    Await send(member) for each member, keeping at most BROADCAST_CONCURRENCY in
+    flight. On flood control (429) every send of the broadcast waits out
+    retry_after and the throttled one is retried, up to BROADCAST_RETRIES times.
+    """
+    semaphore = asyncio.Semaphore(transport.BROADCAST_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    resume_at = 0.0
+
+    async def deliver(member):
+        nonlocal resume_at
+        async with semaphore:
+            for _ in range(transport.BROADCAST_RETRIES + 1):
+                delay = resume_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    await send(member)
+                    return
+                except TelegramRetryAfter as e:
+                    resume_at = max(resume_at, loop.time() + e.retry_after)
+                    logging.warning(f"Flood control while trying to {action} {member.user_id}, retrying in {e.retry_after}s")
+                except Exception as e:
+                    logging.error(f"Failed to {action} {member.user_id}: {e}")
+                    return
+            logging.error(f"Failed to {action} {member.user_id}: still rate-limited")
+
+    await asyncio.gather(*(deliver(m) for m in members))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def render_status_board() -> str:
+    """Render the shared status board text from the roster (shared by all chats)."""
+    global status_board_text, status_board_roster
+    roster.ensure_fresh()
+    status_board_roster = roster.loaded_at
+    if not roster:
+        status_board_text = "Никого нет. Нажмите /start, чтобы зарегистрироваться."
+    else:
+        status_board_text = build_status_text(roster, current_threshold())
+    return status_board_text
+
+
+def request_status_board_refresh():
+    """Mark boards dirty; edits are coalesced into one rate-limited refresh task."""
+    global status_board_dirty, status_board_task, status_board_text
+    if not status_boards:
+        # nothing to edit; just drop the cached text so the next board re-renders
+        status_board_text = None
+        return
+    status_board_dirty = True
+    if status_board_task is None or status_board_task.done():
+        status_board_task = asyncio.create_task(refresh_status_boards())
+
+
+async def refresh_status_boards():
+    global status_board_dirty, status_board_last_edit
+    loop = asyncio.get_running_loop()
+    while status_board_dirty:
+        wait = status_board_last_edit + STATUS_BOARD_MIN_INTERVAL - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        status_board_dirty = False
+        try:
+            text = render_status_board()
+        except Exception as e:
+            logging.error(f"Failed to render status board: {e}")
+            return
+        digest = text_hash(text)
+        status_board_last_edit = loop.time()
+        for chat_id, message_id in list(status_boards.items()):
+            if status_board_hashes.get(chat_id) == digest:
+                continue
+            try:
+                await bot.edit_message_text(
+                    text=text, chat_id=chat_id, message_id=message_id, reply_markup=main_menu()
+                )
+                status_board_hashes[chat_id] = digest
+            except Exception as e:
+                # board was deleted or became uneditable; stop tracking it
+                logging.info(f"Dropping status board in {chat_id}: {e}")
+                status_boards.pop(chat_id, None)
+                status_board_hashes.pop(chat_id, None)
+
+
+async def post_status_board(chat_id: int):
+    """(Re)post the board in chat; reuses the last rendered text while the roster is unchanged."""
+    roster.ensure_fresh()
+    if status_board_text and status_board_roster == roster.loaded_at:
+        text = status_board_text
+    else:
+        text = render_status_board()
+    prev_id = status_boards.pop(chat_id, None)
+    if prev_id:
+        await delete_message_by_id(chat_id, prev_id)
+    msg = await bot.send_message(chat_id, text, reply_markup=main_menu())
+    status_boards[chat_id] = msg.message_id
+    status_board_hashes[chat_id] = text_hash(text)
+    return msg
+
+
 def current_threshold() -> int:
     try:
         return int(database.get_setting("threshold", database.DEFAULT_THRESHOLD))
@@ -193,9 +428,115 @@ def current_prompt_interval() -> int:
         return PROMPT_INTERVAL_SECONDS
 
 
-def is_quiet_hours() -> bool:
-    hour = datetime.now().hour
-    return QUIET_HOURS_START <= hour < QUIET_HOURS_END
+@lru_cache(maxsize=None)
+def zone(name: str | None) -> ZoneInfo | None:
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def quiet_window(member) -> tuple[int, int, str | None]:
+    """(start, end, tz) for a member, falling back to the bot-wide defaults."""
+    if member is None or member.quiet_start is None or member.quiet_end is None:
+        start, end = QUIET_HOURS_START, QUIET_HOURS_END
+    else:
+        start, end = member.quiet_start, member.quiet_end
+    tz = member.tz if member is not None and member.tz else DEFAULT_TZ
+    return start, end, tz
+
+
+def in_quiet_window(hour: int, start: int, end: int) -> bool:
+    """Windows may wrap midnight (23–7); start == end means no quiet hours."""
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def is_quiet_for(member) -> bool:
+    start, end, tz = quiet_window(member)
+    return in_quiet_window(datetime.now(zone(tz)).hour, start, end)
+
+
+def chat_is_quiet(chat_id: int) -> bool:
+    return is_quiet_for(roster.get(chat_id))
+
+
+def quiet_label(member) -> str:
+    start, end, tz = quiet_window(member)
+    if start == end:
+        return "выключены"
+    return f"{start}:00–{end}:00 ({tz or 'время сервера'})"
+
+
+async def notify(member, kind: str, text: str, reply_markup=None, allow_multiple: bool = False):
+    """Send a notification now, or defer it until the member's quiet hours end."""
+    notification = deferred.Notification(kind, text, reply_markup, allow_multiple)
+    if is_quiet_for(member):
+        deferred_queue.defer(member.user_id, notification)
+        return
+    await send_deferred(member.user_id, notification)
+
+
+async def send_deferred(chat_id: int, notification: deferred.Notification):
+    await send_temp(
+        chat_id,
+        notification.text,
+        reply_markup=notification.reply_markup,
+        allow_multiple=notification.allow_multiple,
+    )
+
+
+def current_group_chat() -> int | None:
+    """Group chat the pool is bound to with /bindgroup; None means announcements go by DM."""
+    try:
+        value = database.get_setting("group_chat_id")
+        return int(value) if value else None
+    except Exception:
+        return None
+
+
+def mention(user_id: int, name: str | None) -> str:
+    return f'<a href="tg://user?id={user_id}">{html.escape(name or str(user_id))}</a>'
+
+
+async def announce(kind: str, text: str, reply_markup=None) -> bool:
+    """
+    Post an HTML announcement to the bound group chat; returns False in DM mode
+    and when the group cannot be reached (e.g. the bot was removed from it), so
+    callers fall back to DMs. Repeating the current kind edits the message in
+    place; a new kind replaces it with a fresh message, since mentions only
+    notify on new messages.
+    """
+    chat_id = current_group_chat()
+    if chat_id is None:
+        return False
+    message_id = group_announcement["message_id"] if group_announcement["chat_id"] == chat_id else None
+    if message_id and group_announcement["kind"] == kind:
+        try:
+            await bot.edit_message_text(
+                text=text, chat_id=chat_id, message_id=message_id,
+                reply_markup=reply_markup, parse_mode="HTML",
+            )
+            return True
+        except Exception as e:
+            if "message is not modified" in str(e):
+                return True
+            logging.info(f"Reposting group announcement in {chat_id}: {e}")
+    await delete_message_by_id(chat_id, message_id)
+    try:
+        msg = await bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode="HTML")
+    except TelegramAPIError as e:
+        logging.error(f"Group announcement to {chat_id} failed, sending DMs instead: {e}")
+        return False
+    group_announcement.update(chat_id=chat_id, message_id=msg.message_id, kind=kind)
+    return True
+
+
+def is_admin(user_id: int) -> bool:
+    return user_id in ADMIN_IDS
 
 
 def generate_invite_code() -> str:
@@ -203,9 +544,29 @@ def generate_invite_code() -> str:
     return secrets.token_urlsafe(6).replace("-", "").replace("_", "")[:8]
 
 
+def invite_expiry() -> datetime | None:
+    if INVITE_TTL_HOURS <= 0:
+        return None
+    return datetime.now(timezone.utc) + timedelta(hours=INVITE_TTL_HOURS)
+
+
+def invite_expiry_text(expires_at: datetime | None) -> str:
+    if expires_at is None:
+        return "Код бессрочный."
+    return f"Действует до {format_datetime(expires_at.astimezone(zone(DEFAULT_TZ)))}."
+
+
+def is_member(user_id: int) -> bool:
+    """Membership from the database, or from the roster snapshot while it is unavailable."""
+    try:
+        return database.user_exists(user_id)
+    except database.DatabaseUnavailable:
+        return roster.get(user_id) is not None
+
+
 async def ensure_member_message(message: types.Message) -> bool:
     """Ensure user is a member; otherwise inform and block."""
-    if database.user_exists(message.from_user.id):
+    if is_member(message.from_user.id):
         return True
     await message.answer(
         "Бот приватный. Доступ только по приглашению. "
@@ -216,14 +577,20 @@ async def ensure_member_message(message: types.Message) -> bool:
 
 async def ensure_member_callback(callback: types.CallbackQuery) -> bool:
     """Ensure user is a member for callbacks."""
-    if database.user_exists(callback.from_user.id):
+    if is_member(callback.from_user.id):
         return True
     await callback.answer("Доступ только по приглашению.", show_alert=True)
     return False
 
 
 def user_drink_code(user_id: int) -> str:
-    return database.get_desire_type(user_id)
+    member = roster.get(user_id)
+    if member is not None:
+        return member.desire_type
+    try:
+        return database.get_desire_type(user_id)
+    except database.DatabaseUnavailable:
+        return database.DEFAULT_DRINK
 
 
 @dp.message(Command("start"))
@@ -233,8 +600,9 @@ async def cmd_start(message: types.Message):
     args = message.text.split()
     invite_code = args[1] if len(args) > 1 else None
 
-    if database.user_exists(user.id):
+    if is_member(user.id):
         database.add_user(user.id, user.full_name)
+        roster.upsert(user.id, user.full_name)
         database.log_event("start", user.id, user.full_name, info="existing_member")
         await answer_clean(
             message,
@@ -246,7 +614,9 @@ async def cmd_start(message: types.Message):
     if invite_code:
         if database.consume_invite(invite_code, user.id, user.full_name):
             database.add_user(user.id, user.full_name)
-            database.log_event("invite_used", user.id, user.full_name, info=invite_code)
+            roster.upsert(user.id, user.full_name)
+            database.log_event("invite_used", user.id, user.full_name, invite_code=invite_code)
+            request_status_board_refresh()
             await answer_clean(
                 message,
                 f"Приглашение принято, {user.full_name}! Нажми «☕️ Я хочу кофе», выбери уровень и напиток.",
@@ -254,7 +624,7 @@ async def cmd_start(message: types.Message):
             )
             return
         else:
-            await answer_clean(message, "Код приглашения не подошёл или уже использован.")
+            await answer_clean(message, "Код приглашения не подошёл, истёк или уже использован.")
             return
 
     await answer_clean(
@@ -263,6 +633,157 @@ async def cmd_start(message: types.Message):
     )
 
 
+@dp.message(Command("tz"))
+async def cmd_timezone(message: types.Message):
+    """/tz Europe/Moscow sets the member's timezone for quiet hours; /tz alone shows it."""
+    if not await ensure_member_message(message):
+        return
+    args = message.text.split()
+    user_id = message.from_user.id
+    if len(args) < 2:
+        await answer_clean(
+            message, f"Тихие часы: {quiet_label(roster.get(user_id))}", reply_markup=main_menu()
+        )
+        return
+    tz = args[1]
+    if zone(tz) is None:
+        await answer_clean(message, "Не знаю такой часовой пояс. Пример: /tz Europe/Moscow")
+        return
+    database.set_user_timezone(user_id, tz)
+    roster.set_timezone(user_id, tz)
+    await answer_clean(
+        message, f"Часовой пояс: {tz}. Тихие часы: {quiet_label(roster.get(user_id))}",
+        reply_markup=main_menu(),
+    )
+
+
+@dp.message(Command("quiet"))
+async def cmd_quiet(message: types.Message):
+    """/quiet 23 7 sets the member's quiet window; /quiet default restores the default."""
+    if not await ensure_member_message(message):
+        return
+    args = message.text.split()
+    user_id = message.from_user.id
+    if len(args) == 2 and args[1] == "default":
+        start = end = None
+    else:
+        try:
+            start, end = int(args[1]), int(args[2])
+        except (ValueError, IndexError):
+            start = end = -1
+        if not (0 <= start <= 23 and 0 <= end <= 23):
+            await answer_clean(
+                message,
+                "Формат: /quiet <начало> <конец> в часах 0–23, например /quiet 23 7. "
+                "/quiet default — вернуть стандартные.",
+            )
+            return
+    database.set_user_quiet_hours(user_id, start, end)
+    roster.set_quiet_hours(user_id, start, end)
+    await answer_clean(
+        message, f"Тихие часы: {quiet_label(roster.get(user_id))}", reply_markup=main_menu()
+    )
+
+
+@dp.message(Command("bindgroup"))
+async def cmd_bind_group(message: types.Message):
+    """Admin-only: /bindgroup in a group chat sends pool announcements there instead of one DM per member."""
+    if not is_admin(message.from_user.id):
+        await answer_clean(message, "Только для администраторов.")
+        return
+    if message.chat.type not in ("group", "supergroup"):
+        await answer_clean(message, "Отправьте /bindgroup в групповом чате, куда слать общие объявления.")
+        return
+    database.set_setting("group_chat_id", message.chat.id)
+    database.log_event("bind_group", message.from_user.id, message.from_user.full_name, info=str(message.chat.id))
+    await answer_clean(
+        message,
+        "Готово: «время кофе», сбросы и мотивация теперь приходят сюда одним сообщением. "
+        "Личные напоминания по-прежнему в ЛС.",
+    )
+
+
+@dp.message(Command("unbindgroup"))
+async def cmd_unbind_group(message: types.Message):
+    """Admin-only: /unbindgroup returns announcements to direct messages."""
+    if not is_admin(message.from_user.id):
+        await answer_clean(message, "Только для администраторов.")
+        return
+    database.set_setting("group_chat_id", "")
+    database.log_event("unbind_group", message.from_user.id, message.from_user.full_name)
+    await answer_clean(message, "Общие объявления снова приходят каждому в ЛС.")
+
+
+@dp.message(Command("invites"))
+async def cmd_bulk_invites(message: types.Message):
+    """/invites 10 creates ten invite codes at once, e.g. to onboard a whole team."""
+    if not await ensure_member_message(message):
+        return
+    args = message.text.split()
+    try:
+        count = int(args[1])
+    except (ValueError, IndexError):
+        count = 0
+    if not (1 <= count <= MAX_BULK_INVITES):
+        await answer_clean(message, f"Формат: /invites <количество>, от 1 до {MAX_BULK_INVITES}.")
+        return
+    expires_at = invite_expiry()
+    codes = []
+    # codes that collide with existing ones are skipped; replace them with new ones
+    for _ in range(INVITE_CODE_ATTEMPTS):
+        codes += database.create_invites(
+            [generate_invite_code() for _ in range(count - len(codes))], message.from_user.id, expires_at
+        )
+        if len(codes) == count:
+            break
+    database.log_event(
+        "invites_created", message.from_user.id, message.from_user.full_name, info=str(len(codes))
+    )
+    shortfall = f"Создано только {len(codes)} из {count}, повторите для остальных.\n" if len(codes) < count else ""
+    await answer_clean(
+        message,
+        f"{shortfall}Коды приглашений ({len(codes)}), по одному на человека:\n"
+        + "\n".join(codes)
+        + f"\n\n{invite_expiry_text(expires_at)} Новый участник вводит: /start <код>",
+        reply_markup=main_menu(),
+    )
+
+
+@dp.message(Command("export"))
+async def cmd_export(message: types.Message):
+    """Admin-only: /export [csv|parquet] [YYYY-MM-DD [YYYY-MM-DD]] sends events and users as files."""
+    if not is_admin(message.from_user.id):
+        await answer_clean(message, "Только для администраторов.")
+        return
+    args = message.text.split()[1:]
+    fmt = args.pop(0) if args and args[0] in export.EXPORT_FORMATS else "csv"
+    try:
+        # dates are local days in DEFAULT_TZ (the server's zone when unset); the
+        # end day is inclusive. astimezone() gives naive server-local days an offset
+        days = [
+            datetime.strptime(a, "%Y-%m-%d").replace(tzinfo=zone(DEFAULT_TZ)).astimezone() for a in args[:2]
+        ]
+    except ValueError:
+        days = None
+    if days is None or len(args) > 2:
+        await answer_clean(
+            message,
+            "Формат: /export [csv|parquet] [с YYYY-MM-DD [по YYYY-MM-DD]], например /export csv 2026-01-01 2026-01-31",
+        )
+        return
+    since = days[0] if days else None
+    until = days[1] + timedelta(days=1) if len(days) > 1 else None
+    await answer_clean(message, "Готовлю выгрузку…")
+    with tempfile.TemporaryDirectory(prefix="coffee-export-") as directory:
+        paths = await asyncio.to_thread(export.export, directory, fmt, since, until)
+        for path in paths:
+            if os.path.getsize(path) > MAX_DOCUMENT_SIZE:
+                await message.answer(f"{os.path.basename(path)} больше 50 МБ, сузьте диапазон дат.")
+                continue
+            await bot.send_document(message.chat.id, FSInputFile(path))
+    await answer_clean(message, f"Выгрузка готова ({len(paths)} файла).", reply_markup=main_menu())
+
+
 @dp.callback_query(F.data == "back_to_menu")
 async def handle_back(callback: types.CallbackQuery):
     if not await ensure_member_callback(callback):
@@ -307,17 +828,20 @@ async def handle_drink(callback: types.CallbackQuery):
         return
     database.add_user(callback.from_user.id, callback.from_user.full_name)
     database.set_desire_type(callback.from_user.id, drink)
-    database.log_event("set_drink", callback.from_user.id, callback.from_user.full_name, info=drink)
+    roster.upsert(callback.from_user.id, callback.from_user.full_name)
+    roster.set_drink(callback.from_user.id, drink)
+    database.log_event("set_drink", callback.from_user.id, callback.from_user.full_name, drink=drink)
     await callback.answer("Напиток обновлён")
     await answer_clean(
         callback.message,
         f"Твой выбор: {drink_label(drink)}.", reply_markup=main_menu()
     )
     await delete_message_safe(callback.message)
-    user = database.get_user(callback.from_user.id)
-    if user and user["desire"] >= current_threshold():
+    request_status_board_refresh()
+    member = roster.get(callback.from_user.id)
+    if member is not None and member.desire >= current_threshold():
         await notify_peers_about_interest(
-            callback.from_user.id, callback.from_user.full_name, user["desire"]
+            callback.from_user.id, callback.from_user.full_name, member.desire
         )
     await check_coffee_status()
 
@@ -341,7 +865,9 @@ async def handle_set_level(callback: types.CallbackQuery):
     username = callback.from_user.full_name
     database.add_user(user_id, username)
     database.set_desire(user_id, level)
-    database.log_event("set_desire", user_id, username, info=f"level:{level}")
+    roster.upsert(user_id, username)
+    roster.set_desire(user_id, level)
+    database.log_event("set_desire", user_id, username, level=level)
 
     await callback.answer("Обновлено")
     if level >= current_threshold():
@@ -357,56 +883,42 @@ async def handle_set_level(callback: types.CallbackQuery):
             reply_markup=main_menu(),
         )
     await delete_message_safe(callback.message)
+    request_status_board_refresh()
     await check_coffee_status()
 
 
 async def check_coffee_status():
-    users = database.get_all_users()
-    if not users:
-        return
-
-    ready_users = [u for u in users if u["desire"] >= current_threshold()]
-
-    if len(ready_users) == len(users) and len(users) > 0:
-        if is_quiet_hours():
+    roster.ensure_fresh()
+    if roster.all_ready(current_threshold()):
+        motivation = random.choice(MOTIVATION_MESSAGES)
+
+        def coffee_time_text(name):
+            text = "☕ ВРЕМЯ КОФЕ! ☕\n\nВсе хотят кофе:\n"
+            for m in roster:
+                text += f"- {name(m)}: {m.desire}/10 ({drink_label(m.desire_type)})\n"
+            text += f"\n{motivation}"
+            text += "\nПосле того как кофе будет выпито, нажмите «Кофе выпито», чтобы сбросить уровни."
+            return text
+
+        if await announce(
+            "coffee_time", coffee_time_text(lambda m: mention(m.user_id, m.username)), reset_keyboard()
+        ):
             return
-        text = "☕ ВРЕМЯ КОФЕ! ☕\n\nВсе хотят кофе:\n"
-        for u in users:
-            text += f"- {u['username']}: {u['desire']}/10 ({drink_label(u.get('desire_type'))})\n"
-
-        text += f"\n{random.choice(MOTIVATION_MESSAGES)}"
-        text += "\nПосле того как кофе будет выпито, нажмите «Кофе выпито», чтобы сбросить уровни."
-
-        notify_markup = InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(text="✅ Кофе выпито", callback_data="reset")]]
+        text = coffee_time_text(lambda m: m.username)
+        await broadcast(
+            roster,
+            lambda m: notify(m, "coffee_time", text, reset_keyboard(), allow_multiple=True),
+            "send message to",
         )
 
-        for u in users:
-            try:
-                await send_temp(u["user_id"], text, reply_markup=notify_markup, allow_multiple=True)
-            except Exception as e:
-                logging.error(f"Failed to send message to {u['user_id']}: {e}")
-
 
 @dp.callback_query(F.data == "status")
 async def handle_status(callback: types.CallbackQuery):
+    """Show the live status board; it is edited in place on every change."""
     if not await ensure_member_callback(callback):
         return
-    users = database.get_all_users()
-    if not users:
-        await callback.answer("Пока нет зарегистрированных участников.", show_alert=True)
-        await answer_clean(
-            callback.message,
-            "Никого нет. Нажмите /start, чтобы зарегистрироваться.", reply_markup=main_menu()
-        )
-        await delete_message_safe(callback.message)
-        return
-
-    text = build_status_text(users)
-
     await callback.answer()
-    await answer_clean(callback.message, text, reply_markup=main_menu())
-    await delete_message_safe(callback.message)
+    await post_status_board(callback.message.chat.id)
     await delete_message_safe(callback.message)
 
 
@@ -414,7 +926,7 @@ async def handle_status(callback: types.CallbackQuery):
 async def handle_weekly_stats(callback: types.CallbackQuery):
     if not await ensure_member_callback(callback):
         return
-    stats = database.weekly_coffee_stats()
+    stats = await stats_cache.get_or_compute(("coffee_gaps", 7), database.weekly_coffee_stats)
 
     count = stats["count"]
     if count == 0:
@@ -460,45 +972,62 @@ def format_drink_counts(counts: dict) -> str:
         parts.append(f"{drink_label(code)}: {cnt}")
     return "; ".join(parts)
 
+
+def sparkline(values) -> str:
+    values = list(values)
+    top = max(values, default=0)
+    if top <= 0:
+        return SPARK_BARS[0] * len(values)
+    return "".join(SPARK_BARS[(v * (len(SPARK_BARS) - 1)) // top] for v in values)
+
+
+def format_peaks(peaks) -> str:
+    if not peaks:
+        return "—"
+    return ", ".join(f"{WEEKDAY_LABELS[day]} {hour:02d}:00 ({cnt})" for day, hour, cnt in peaks)
+
+
+def build_analytics_text(report: dict) -> str:
+    if report["count"] == 0 and report["desire_count"] == 0:
+        return "Пока нет данных для аналитики."
+    lines = [
+        "🔥 Аналитика за всё время:",
+        f"• Выпито кружек: {report['count']}, желаний: {report['desire_count']}",
+        f"• Перерыв p50: {format_gap(report['gap_p50'])}, p90: {format_gap(report['gap_p90'])}",
+    ]
+    prediction = report["next_break"]
+    if prediction:
+        at = prediction["at"]
+
+        def moment(dt):
+            # window ends on another day than the estimate carry their own date
+            return dt.strftime("%H:%M") if dt.date() == at.date() else dt.strftime("%d.%m %H:%M")
+
+        lines.append(
+            f"• Следующий перерыв: ~{at.strftime('%d.%m %H:%M')} "
+            f"(окно {moment(prediction['window_start'])}–{moment(prediction['window_end'])})"
+        )
+    lines.append(f"• Пик желания: {format_peaks(report['desire_peaks'])}")
+    lines.append(f"• Пик кофе: {format_peaks(report['consumed_peaks'])}")
+    lines.append(f"• Кофе по часам 0–23: {sparkline(report['consumed_by_hour'])}")
+    if report["drink_trends"]:
+        lines.append(f"• Тренд по неделям ({analytics.TREND_WEEKS} нед.):")
+        for code, weekly in report["drink_trends"].items():
+            lines.append(f"  {drink_label(code)}: {sparkline(weekly)} {weekly[-1]} за неделю")
+    return "\n".join(lines)
+
+
 @dp.callback_query(F.data == "settings")
 async def handle_settings(callback: types.CallbackQuery):
     if not await ensure_member_callback(callback):
         return
-    threshold = current_threshold()
-    interval = current_prompt_interval()
-    text = (
-        "⚙️ Настройки\n"
-        f"• Порог готовности: {threshold}\n"
-        f"• Интервал напоминаний: {interval // 60} мин\n"
-        f"• Тихие часы: {QUIET_HOURS_START}:00–{QUIET_HOURS_END}:00\n"
-    )
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="📊 Статус", callback_data="status"),
-                InlineKeyboardButton(text="✅ Кофе выпито", callback_data="reset"),
-            ],
-            [InlineKeyboardButton(text="🥤 Напиток", callback_data="drink_menu")],
-            [
-                InlineKeyboardButton(text="📈 7 дней", callback_data="weekly_stats"),
-                InlineKeyboardButton(text="👤 7д по людям", callback_data="weekly_user_stats"),
-            ],
-            [InlineKeyboardButton(text="📊 Всё время", callback_data="all_stats")],
-            [InlineKeyboardButton(text="🔑 Пригласить", callback_data="invite")],
-            [
-                InlineKeyboardButton(text="Порог -1", callback_data="set_threshold:-1"),
-                InlineKeyboardButton(text="Порог +1", callback_data="set_threshold:+1"),
-            ],
-            [
-                InlineKeyboardButton(text="Интервал 30м", callback_data="set_interval:1800"),
-                InlineKeyboardButton(text="Интервал 60м", callback_data="set_interval:3600"),
-                InlineKeyboardButton(text="Интервал 90м", callback_data="set_interval:5400"),
-            ],
-            [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_menu")],
-        ]
+    text = settings_text(
+        current_threshold(), current_prompt_interval(), quiet_label(roster.get(callback.from_user.id))
     )
     await callback.answer()
-    await answer_clean(callback.message, text, reply_markup=kb)
+    await answer_clean(
+        callback.message, text, reply_markup=settings_keyboard(is_admin(callback.from_user.id))
+    )
     await delete_message_safe(callback.message)
 
 
@@ -511,6 +1040,7 @@ async def handle_set_threshold(callback: types.CallbackQuery):
         new_value = max(1, min(10, current_threshold() + delta))
         database.set_setting("threshold", new_value)
         await callback.answer(f"Порог {new_value}")
+        request_status_board_refresh()
     except Exception:
         await callback.answer("Не удалось изменить порог", show_alert=True)
         return
@@ -531,22 +1061,67 @@ async def handle_set_interval(callback: types.CallbackQuery):
     await handle_settings(callback)
 
 
+@dp.callback_query(F.data.startswith("profile:"))
+async def handle_profile(callback: types.CallbackQuery):
+    """Admin-only: sample the running bot for N seconds and report hot functions."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Только для администраторов.", show_alert=True)
+        return
+    try:
+        seconds = max(1, min(profiler.MAX_PROFILE_SECONDS, int(callback.data.split(":")[1])))
+    except (ValueError, IndexError):
+        await callback.answer("Не получилось прочитать длительность.", show_alert=True)
+        return
+    if profiler.is_running():
+        await callback.answer("Профилирование уже идёт.", show_alert=True)
+        return
+    await callback.answer(f"Профилирую {seconds} с…")
+    chat_id = callback.message.chat.id
+    try:
+        result = await asyncio.to_thread(profiler.profile, seconds)
+    except RuntimeError:
+        await send_clean(chat_id, "Профилирование уже идёт.", reply_markup=main_menu())
+        return
+    await send_clean(chat_id, profiler.summary(result)[:4000], reply_markup=main_menu())
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    await bot.send_document(
+        chat_id,
+        BufferedInputFile(profiler.collapsed(result).encode("utf-8"), filename=f"profile-{stamp}.collapsed"),
+        caption="Collapsed stacks для flamegraph.pl / speedscope",
+    )
+
+
+@dp.callback_query(F.data == "stalls")
+async def handle_stalls(callback: types.CallbackQuery):
+    """Admin-only: recent event-loop stalls and slow handlers from the watchdog."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Только для администраторов.", show_alert=True)
+        return
+    await callback.answer()
+    await send_clean(callback.message.chat.id, loop_watchdog.summary()[:4000], reply_markup=main_menu())
+
+
 @dp.callback_query(F.data.startswith("adjust:"))
 async def handle_adjust(callback: types.CallbackQuery):
     if not await ensure_member_callback(callback):
         return
     delta = int(callback.data.split(":")[1])
-    user = database.get_user(callback.from_user.id)
-    current = user["desire"] if user else 0
+    member = roster.get(callback.from_user.id)
+    current = member.desire if member is not None else 0
     new_level = max(0, min(10, current + delta))
     database.add_user(callback.from_user.id, callback.from_user.full_name)
     database.set_desire(callback.from_user.id, new_level)
-    database.log_event("set_desire", callback.from_user.id, callback.from_user.full_name, info=f"adjust:{new_level}")
+    roster.upsert(callback.from_user.id, callback.from_user.full_name)
+    roster.set_desire(callback.from_user.id, new_level)
+    database.log_event(
+        "set_desire", callback.from_user.id, callback.from_user.full_name, info="adjust", level=new_level
+    )
     await callback.answer("Обновлено")
     await answer_clean(
         callback.message,
         f"Новый уровень: {new_level}/10.", reply_markup=main_menu()
     )
+    request_status_board_refresh()
     await check_coffee_status()
 
 
@@ -554,8 +1129,8 @@ async def handle_adjust(callback: types.CallbackQuery):
 async def handle_all_stats(callback: types.CallbackQuery):
     if not await ensure_member_callback(callback):
         return
-    weekly = database.weekly_coffee_stats()
-    overall = database.all_time_coffee_stats()
+    weekly = await stats_cache.get_or_compute(("coffee_gaps", 7), database.weekly_coffee_stats)
+    overall = await stats_cache.get_or_compute(("coffee_gaps", "all"), database.all_time_coffee_stats)
 
     def block(label, stats):
         return (
@@ -574,11 +1149,22 @@ async def handle_all_stats(callback: types.CallbackQuery):
     await answer_clean(callback.message, text, reply_markup=main_menu())
 
 
+@dp.callback_query(F.data == "analytics")
+async def handle_analytics(callback: types.CallbackQuery):
+    if not await ensure_member_callback(callback):
+        return
+    report = await stats_cache.get_or_compute(("analytics", "all"), analytics.coffee_analytics)
+    text = build_analytics_text(report)
+    await callback.answer()
+    await answer_clean(callback.message, text, reply_markup=main_menu())
+    await delete_message_safe(callback.message)
+
+
 @dp.callback_query(F.data == "weekly_user_stats")
 async def handle_weekly_user_stats(callback: types.CallbackQuery):
     if not await ensure_member_callback(callback):
         return
-    stats = database.user_weekly_stats()
+    stats = await stats_cache.get_or_compute(("user_stats", 7), database.user_weekly_stats)
     if not stats:
         await callback.answer()
         await answer_clean(callback.message, "За последние 7 дней нет данных.", reply_markup=main_menu())
@@ -612,21 +1198,29 @@ async def handle_reset(callback: types.CallbackQuery):
     if not await ensure_member_callback(callback):
         return
 
-    if not database.user_exists(user_id):
+    if not is_member(user_id):
         await callback.answer("Сброс могут делать только участники.", show_alert=True)
         return
 
     database.reset_desires()
-    users = database.get_all_users()
+    roster.ensure_fresh()
+    roster.reset_desires()
+    # pending "coffee time"/reminder notifications describe a state that no longer exists
+    deferred_queue.clear()
     drink = user_drink_code(user_id)
-    database.log_event("coffee_consumed", user_id, username, info=f"drink:{drink}")
-
-    info_text = f"{username} отметил(а), что кофе выпито ({drink_label(drink)}). Все уровни сброшены."
-    for u in users:
-        try:
-            await send_clean(u["user_id"], info_text, reply_markup=main_menu())
-        except Exception as e:
-            logging.error(f"Failed to send message to {u['user_id']}: {e}")
+    database.log_event("coffee_consumed", user_id, username, drink=drink)
+    request_status_board_refresh()
+
+    info_text = "{} отметил(а), что кофе выпито ({}). Все уровни сброшены."
+    if not await announce(
+        "coffee_consumed", info_text.format(mention(user_id, username), drink_label(drink)), main_menu()
+    ):
+        info_text = info_text.format(username, drink_label(drink))
+        await broadcast(
+            roster,
+            lambda m: send_clean(m.user_id, info_text, reply_markup=main_menu()),
+            "send message to",
+        )
 
     await callback.answer("Сброс выполнен.", show_alert=True)
     await delete_message_safe(callback.message)
@@ -634,78 +1228,65 @@ async def handle_reset(callback: types.CallbackQuery):
 
 async def notify_peers_about_interest(user_id: int, username: str, level: int):
     """Notify other members that someone wants coffee to prompt them to respond."""
-    if is_quiet_hours():
-        return
-    users = database.get_all_users()
+    roster.ensure_fresh()
     drink = drink_label(user_drink_code(user_id))
-    for u in users:
-        if u["user_id"] == user_id:
-            continue
-        try:
-            await send_temp(
-                u["user_id"],
-                (
-                    f"{username} хочет {drink} ({level}/10).\n"
-                    "Какое у тебя желание на этот напиток? Обнови свой уровень:"
-                ),
-                reply_markup=level_keyboard(),
-            )
-        except Exception as e:
-            logging.error(f"Failed to notify {u['user_id']} about interest: {e}")
+    text = (
+        f"{username} хочет {drink} ({level}/10).\n"
+        "Какое у тебя желание на этот напиток? Обнови свой уровень:"
+    )
+    markup = level_keyboard()
+    await broadcast(
+        (m for m in roster if m.user_id != user_id),
+        lambda m: notify(m, "peer_interest", text, markup),
+        "notify about interest",
+    )
 
 
 async def send_desire_prompts():
     """Send hourly prompt to users below threshold."""
-    if is_quiet_hours():
-        return
-    users = database.get_all_users()
-    for u in users:
-        if u["desire"] < current_threshold():
-            try:
-                await send_temp(
-                    u["user_id"],
-                    "Напомни свой текущий уровень желания кофе:",
-                    reply_markup=level_keyboard(),
-                )
-            except Exception as e:
-                logging.error(f"Failed to prompt user {u['user_id']}: {e}")
+    roster.ensure_fresh()
+    await broadcast(
+        roster.not_ready(current_threshold()),
+        lambda m: notify(
+            m, "desire_prompt", "Напомни свой текущий уровень желания кофе:", level_keyboard()
+        ),
+        "prompt user",
+    )
 
 
 async def send_motivation_if_ready():
     """Send motivational reminders while everyone is ready but кофе ещё не отмечено."""
     global motivation_last_at
-    users = database.get_all_users()
-    if not users:
-        return
-
-    ready_users = [u for u in users if u["desire"] >= current_threshold()]
-    if len(ready_users) == len(users) and len(users) > 0:
+    roster.ensure_fresh()
+    if roster.all_ready(current_threshold()):
         now = asyncio.get_event_loop().time()
         if now - motivation_last_at < MOTIVATION_COOLDOWN:
             return
         motivation_last_at = now
-        if is_quiet_hours():
-            return
         text = (
             f"{random.choice(MOTIVATION_MESSAGES)}\n\n"
             "Все хотят кофе, но кнопка «Кофе выпито» ещё не нажата. "
             "Быстро выпейте кофе для хорошего настроения!"
         )
-        markup = InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(text="✅ Кофе выпито", callback_data="reset")]]
+        mentions = ", ".join(mention(m.user_id, m.username) for m in roster)
+        if await announce("motivation", f"{mentions}\n\n{text}", reset_keyboard()):
+            return
+        await broadcast(
+            roster,
+            lambda m: notify(m, "motivation", text, reset_keyboard()),
+            "send motivation to",
         )
-        for u in users:
-            try:
-                await send_temp(u["user_id"], text, reply_markup=markup)
-            except Exception as e:
-                logging.error(f"Failed to send motivation to {u['user_id']}: {e}")
 
 
 async def scheduler():
     """Hourly scheduler for prompts and motivational reminders."""
     while True:
-        await send_desire_prompts()
-        await send_motivation_if_ready()
+        with loop_watchdog.track("scheduler"):
+            await send_desire_prompts()
+            await send_motivation_if_ready()
+        if status_board_roster != roster.loaded_at:
+            # the roster was reloaded (changes from other replicas): re-render the boards
+            request_status_board_refresh()
         await asyncio.sleep(current_prompt_interval())
 
 
@@ -721,20 +1302,57 @@ async def fallback(message: types.Message):
     )
 
 
+@dp.error(ExceptionTypeFilter(database.DatabaseUnavailable))
+async def handle_database_unavailable(event: ErrorEvent):
+    """Operations with no in-memory fallback (invites, reports) answer instead of hanging."""
+    logging.warning(f"Database unavailable while handling update {event.update.update_id}: {event.exception}")
+    text = "База данных временно недоступна, попробуйте чуть позже."
+    try:
+        if event.update.callback_query:
+            await event.update.callback_query.answer(text, show_alert=True)
+        elif event.update.message:
+            await event.update.message.answer(text)
+    except Exception as e:
+        logging.error(f"Failed to report database outage: {e}")
+
+
+async def replay_queued_writes():
+    """Replays writes queued while the database was unavailable."""
+    while True:
+        await asyncio.sleep(WRITE_REPLAY_INTERVAL)
+        if database.pending_writes():
+            if await asyncio.to_thread(database.replay_pending_writes):
+                request_status_board_refresh()
+
+
+async def sweep_expired_invites():
+    """Deactivates expired invites so only live ones stay in the partial index."""
+    while True:
+        try:
+            swept = await asyncio.to_thread(database.expire_invites)
+            if swept:
+                logging.info(f"Deactivated {swept} expired invites")
+        except Exception as e:
+            logging.error(f"Failed to sweep expired invites: {e}")
+        await asyncio.sleep(INVITE_SWEEP_INTERVAL)
+
+
 @dp.callback_query(F.data == "invite")
 async def handle_invite(callback: types.CallbackQuery):
     if not await ensure_member_callback(callback):
         return
 
     code = generate_invite_code()
-    database.create_invite(code, callback.from_user.id)
-    database.log_event("invite_created", callback.from_user.id, callback.from_user.full_name, info=code)
+    expires_at = invite_expiry()
+    database.create_invite(code, callback.from_user.id, expires_at)
+    database.log_event("invite_created", callback.from_user.id, callback.from_user.full_name, invite_code=code)
 
     await callback.answer("Инвайт сгенерирован")
     await answer_clean(
         callback.message,
         f"Отправьте этот код новому участнику:\n{code}\n"
-        "Новый участник должен ввести: /start <код>",
+        f"{invite_expiry_text(expires_at)} Новый участник должен ввести: /start <код>\n"
+        "Несколько кодов сразу: /invites <количество>",
         reply_markup=main_menu(),
     )
     await delete_message_safe(callback.message)
@@ -742,14 +1360,23 @@ async def handle_invite(callback: types.CallbackQuery):
 
 async def main():
     database.init_db()
+    roster.refresh()
     if DEFAULT_INVITE_CODE:
         database.create_invite(DEFAULT_INVITE_CODE, 0)
         logging.info(f"Default invite ensured: {DEFAULT_INVITE_CODE}")
     print("Database initialized.")
+    loop_watchdog.start()
     scheduler_task = asyncio.create_task(scheduler())
+    deferred_task = asyncio.create_task(deferred_queue.run(chat_is_quiet, send_deferred))
+    replay_task = asyncio.create_task(replay_queued_writes())
+    sweeper_task = asyncio.create_task(sweep_expired_invites())
     await dp.start_polling(bot)
     scheduler_task.cancel()
+    deferred_task.cancel()
+    replay_task.cancel()
+    sweeper_task.cancel()
 
 
 if __name__ == "__main__":
+    transport.install_event_loop_policy()
     asyncio.run(main())
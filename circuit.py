@@ -0,0 +1,57 @@
+"""Circuit breaker for the database.
+
+After `failure_threshold` consecutive failures the circuit opens and callers fail
+fast instead of waiting on timeouts. Every `reset_timeout` seconds one trial call
+is let through; its success closes the circuit again.
+"""
+import logging
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if a call may go through now (always when closed, one trial per reset_timeout when open)."""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            # let one trial through; the next one waits another reset_timeout
+            self._opened_at = now
+            return True
+
+    def record_success(self):
+        if self.state == CLOSED and self.failures == 0:
+            return
+        with self._lock:
+            if self.state == OPEN:
+                logging.info(f"{self.name}: circuit closed, back to normal")
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == OPEN:
+                self._opened_at = time.monotonic()
+            elif self.failures >= self.failure_threshold:
+                logging.error(
+                    f"{self.name}: circuit opened after {self.failures} failures, "
+                    f"retrying every {self.reset_timeout:.0f}s"
+                )
+                self.state = OPEN
+                self._opened_at = time.monotonic()
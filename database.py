@@ -1,82 +1,397 @@
+import collections
+import functools
+import logging
 import os
-from datetime import datetime
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+
+import circuit
+import stats_cache
 
 DB_HOST = os.getenv("DB_HOST", "db")
 DB_PORT = int(os.getenv("DB_PORT", "5432"))
 DB_NAME = os.getenv("DB_NAME", "coffee_bot")
 DB_USER = os.getenv("DB_USER", "coffee")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "coffee")
+# optional read replica (libpq DSN) for reporting queries
+DB_REPLICA_DSN = os.getenv("DB_REPLICA_DSN")
+REPLICA_MAX_STALENESS = float(os.getenv("DB_REPLICA_MAX_STALENESS", "30"))  # seconds
+REPLICA_CHECK_INTERVAL = 10  # seconds a replica staleness verdict is reused
+# psycopg2 pools keep only DB_POOL_MIN idle connections (and their prepared
+# statements); connections opened above that are closed when returned
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "4"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+# keep handlers responsive when Postgres is slow or down
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "2"))  # seconds; libpq's minimum is 2
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "2000"))  # ms, handler queries
+DB_REPORT_STATEMENT_TIMEOUT = int(os.getenv("DB_REPORT_STATEMENT_TIMEOUT", "30000"))  # ms, stats reports
+DB_EXPORT_STATEMENT_TIMEOUT = int(os.getenv("DB_EXPORT_STATEMENT_TIMEOUT", "600000"))  # ms, /export COPY
+# a host that stops answering (partition, dead VM) would otherwise block a
+# query in recv() until the kernel gives up on TCP, ~15 min; keepalive probes
+# and tcp_user_timeout turn it into a connection error within this budget
+DB_TCP_USER_TIMEOUT = int(os.getenv("DB_TCP_USER_TIMEOUT", str(DB_STATEMENT_TIMEOUT)))  # ms
+DB_KEEPALIVE_IDLE = 1  # seconds of silence before the first keepalive probe
+DB_KEEPALIVE_INTERVAL = 1  # seconds between probes
+DB_KEEPALIVE_COUNT = 3  # unanswered probes before the connection is dropped
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "3"))
+DB_BREAKER_RESET = float(os.getenv("DB_BREAKER_RESET", "10"))  # seconds between trial calls
+DB_WRITE_QUEUE_MAX = int(os.getenv("DB_WRITE_QUEUE_MAX", "10000"))  # writes held while the DB is down
+INVITE_SWEEP_BATCH = 1000  # expired invites deactivated per statement
 
 DEFAULT_THRESHOLD = 7
 DEFAULT_PROMPT_INTERVAL = 3600  # seconds
 DEFAULT_DRINK = 'coffee'
+STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", "5000"))
+# drink code <-> SMALLINT id stored in events.drink; ids must never be reused
+DRINK_IDS = {
+    'coffee': 1,
+    'latte': 2,
+    'milk': 3,
+    'espresso': 4,
+}
+DRINK_CODES = {drink_id: code for code, drink_id in DRINK_IDS.items()}
+# logging one of these makes cached stats reports stale
+STATS_EVENT_TYPES = {'coffee_consumed', 'set_desire', 'set_drink'}
 
 
-def get_connection():
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        cursor_factory=psycopg2.extras.RealDictCursor,
-    )
+# Hot queries, prepared once per pooled connection and run with EXECUTE so
+# Postgres skips parsing and planning them on every call.
+PREPARED_STATEMENTS = {
+    "user_exists": ("SELECT 1 FROM users WHERE user_id = $1", 1),
+    "set_desire": ("UPDATE users SET desire = $1 WHERE user_id = $2", 2),
+    "log_event": (
+        """
+        INSERT INTO events (event_type, user_id, username, info, level, drink, invite_code, created_at)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, COALESCE($8, NOW()))
+        """,
+        8,
+    ),
+    "get_setting": ("SELECT value FROM settings WHERE key = $1", 1),
+}
+
+
+class DatabaseUnavailable(Exception):
+    """The database is unreachable or too slow, or the circuit breaker is open."""
+
+
+# errors that mean "the server is not answering", as opposed to a bad query
+UNAVAILABLE_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+breaker = circuit.CircuitBreaker("database", DB_BREAKER_FAILURES, DB_BREAKER_RESET)
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Connection that remembers whether PREPARED_STATEMENTS were registered on it."""
+    prepared = False
+
+
+def _timeout_options(statement_timeout):
+    return f"-c statement_timeout={statement_timeout}" if statement_timeout else None
+
+
+def _connection_args(statement_timeout=None):
+    """libpq timeouts shared by every connection: connect, statement and dead-peer detection."""
+    return {
+        "connect_timeout": DB_CONNECT_TIMEOUT,
+        "options": _timeout_options(statement_timeout),
+        "keepalives": 1,
+        "keepalives_idle": DB_KEEPALIVE_IDLE,
+        "keepalives_interval": DB_KEEPALIVE_INTERVAL,
+        "keepalives_count": DB_KEEPALIVE_COUNT,
+        "tcp_user_timeout": DB_TCP_USER_TIMEOUT,
+    }
+
+
+def connect(connection_factory=None, statement_timeout=None):
+    """A new, unpooled connection (migrations, streaming cursors)."""
+    if not breaker.allow():
+        raise DatabaseUnavailable("circuit breaker is open")
+    try:
+        conn = psycopg2.connect(
+            host=DB_HOST,
+            port=DB_PORT,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            cursor_factory=psycopg2.extras.RealDictCursor,
+            connection_factory=connection_factory,
+            **_connection_args(statement_timeout),
+        )
+    except psycopg2.OperationalError as e:
+        breaker.record_failure()
+        raise DatabaseUnavailable(str(e)) from e
+    breaker.record_success()
     conn.autocommit = True
     return conn
 
 
-def init_db():
-    with get_connection() as conn, conn.cursor() as cursor:
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                username TEXT,
-                desire INTEGER DEFAULT 0,
-                desire_type TEXT DEFAULT 'coffee',
-                created_at TIMESTAMPTZ DEFAULT NOW()
-            )
-            """
-        )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS events (
-                id BIGSERIAL PRIMARY KEY,
-                event_type TEXT NOT NULL,
-                user_id BIGINT,
-                username TEXT,
-                info TEXT,
-                created_at TIMESTAMPTZ DEFAULT NOW()
-            )
-            """
-        )
-        cursor.execute(
-            "CREATE INDEX IF NOT EXISTS events_created_at_idx ON events(created_at)"
-        )
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    cursor_factory=psycopg2.extras.RealDictCursor,
+                    connection_factory=PreparedConnection,
+                    **_connection_args(DB_STATEMENT_TIMEOUT),
+                )
+    return _pool
+
+
+def _discard_pool(pool):
+    """Drop a pool whose connections broke; after a server restart they are all stale."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    if not pool.closed:
+        pool.closeall()
+
+
+@contextmanager
+def get_connection():
+    """
+    Borrow a pooled autocommit connection for the duration of the with-block.
+    Raises DatabaseUnavailable right away while the circuit breaker is open, and
+    in place of connection errors and statement timeouts.
+    """
+    if not breaker.allow():
+        raise DatabaseUnavailable("circuit breaker is open")
+    pool = None
+    try:
+        pool = _get_pool()
+        conn = pool.getconn()
+    except psycopg2.pool.PoolError:
+        # every pooled connection is busy; don't fail the request over it
+        logging.warning(f"Database pool exhausted ({DB_POOL_MAX}), opening an extra connection")
+        pool = None
+        conn = connect(PreparedConnection, DB_STATEMENT_TIMEOUT)
+    except UNAVAILABLE_ERRORS as e:
+        breaker.record_failure()
+        raise DatabaseUnavailable(str(e)) from e
+    try:
+        conn.autocommit = True
+        yield conn
+    except UNAVAILABLE_ERRORS as e:
+        breaker.record_failure()
+        if pool is not None and conn.closed:
+            _discard_pool(pool)
+        raise DatabaseUnavailable(str(e)) from e
+    except Exception:
+        breaker.record_success()  # the server answered, the query itself failed
+        raise
+    else:
+        breaker.record_success()
+    finally:
+        if pool is None or pool.closed:
+            conn.close()
+        else:
+            # broken connections are dropped instead of being handed out again
+            pool.putconn(conn, close=bool(conn.closed))
+
+
+def execute_prepared(cursor, name, params):
+    """Run one of PREPARED_STATEMENTS, registering them on first use of the connection."""
+    conn = cursor.connection
+    if not conn.prepared:
+        # one round trip; a multi-statement query runs as a single transaction
+        cursor.execute(";".join(
+            f"PREPARE {statement} AS {sql}" for statement, (sql, _) in PREPARED_STATEMENTS.items()
+        ))
+        conn.prepared = True
+    arity = PREPARED_STATEMENTS[name][1]
+    cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * arity)})", params)
+
+
+# last replica health verdict, shared by the worker threads running reports
+_replica_state = {"checked_at": None, "usable": False}
+
+
+def replica_lag(conn):
+    """Seconds the replica is behind the primary (0 when caught up or not a standby)."""
+    with conn.cursor() as cursor:
         cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS invites (
-                code TEXT PRIMARY KEY,
-                created_by BIGINT,
-                created_at TIMESTAMPTZ DEFAULT NOW(),
-                used_by BIGINT,
-                used_at TIMESTAMPTZ,
-                active BOOLEAN DEFAULT TRUE
-            )
-            """
+            '''
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 'Infinity')
+            END AS lag
+            '''
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-            """
+        return float(cursor.fetchone()["lag"])
+
+
+def get_read_connection():
+    """
+    Connection for read-only reporting queries. Uses the replica when one is
+    configured, reachable and at most REPLICA_MAX_STALENESS seconds behind;
+    otherwise falls back to the primary.
+    """
+    if not DB_REPLICA_DSN:
+        return connect(statement_timeout=DB_REPORT_STATEMENT_TIMEOUT)
+    checked_at = _replica_state["checked_at"]
+    recheck = checked_at is None or time.monotonic() - checked_at > REPLICA_CHECK_INTERVAL
+    if not recheck and not _replica_state["usable"]:
+        return connect(statement_timeout=DB_REPORT_STATEMENT_TIMEOUT)
+    try:
+        conn = psycopg2.connect(
+            DB_REPLICA_DSN,
+            cursor_factory=psycopg2.extras.RealDictCursor,
+            **_connection_args(DB_REPORT_STATEMENT_TIMEOUT),
         )
-    ensure_default_settings()
+        conn.autocommit = True
+    except psycopg2.OperationalError as e:
+        logging.warning(f"Read replica unavailable, using primary: {e}")
+        _replica_state.update(checked_at=time.monotonic(), usable=False)
+        return connect(statement_timeout=DB_REPORT_STATEMENT_TIMEOUT)
+
+    if recheck:
+        try:
+            lag = replica_lag(conn)
+        except psycopg2.Error as e:
+            logging.warning(f"Could not check read replica lag: {e}")
+            lag = float("inf")
+        usable = lag <= REPLICA_MAX_STALENESS
+        if usable != _replica_state["usable"]:
+            logging.info(f"Read replica {'in use' if usable else 'skipped'} (lag {lag:.1f}s)")
+        _replica_state.update(checked_at=time.monotonic(), usable=usable)
+
+    if _replica_state["usable"]:
+        return conn
+    conn.close()
+    return connect(statement_timeout=DB_REPORT_STATEMENT_TIMEOUT)
+
+
+def iter_query_batches(sql, params=None, batch_size=STREAM_BATCH_SIZE, read_only=False):
+    """
+    Run a read query through a named server-side cursor and yield lists of at most
+    `batch_size` plain tuples, so only one batch is held in memory at a time.
+    `read_only` queries may be served by the read replica.
+    """
+    if read_only:
+        conn = get_read_connection()
+    else:
+        conn = connect(statement_timeout=DB_REPORT_STATEMENT_TIMEOUT)
+    try:
+        # named cursors only exist inside a transaction
+        conn.set_session(readonly=True, autocommit=False)
+        with conn.cursor(
+            name=f"stream_{uuid.uuid4().hex}",
+            cursor_factory=psycopg2.extensions.cursor,
+        ) as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        conn.rollback()
+    except UNAVAILABLE_ERRORS as e:
+        raise DatabaseUnavailable(str(e)) from e
+    finally:
+        conn.close()
+
+
+def iter_query(sql, params=None, batch_size=STREAM_BATCH_SIZE, read_only=False):
+    """Row-by-row view over iter_query_batches."""
+    for rows in iter_query_batches(sql, params, batch_size, read_only):
+        yield from rows
+
+
+# -------- Degraded mode: writes queued while the database is unavailable --------
+
+_pending_writes = collections.deque()
+# the queued write replay_pending_writes is applying right now, if any
+_replaying = None
+# last known settings values, served while the database is unavailable
+_settings_snapshot = {}
+
+
+def replayable(timestamp_arg=None):
+    """
+    Decorate a write so that, while the database is unavailable, the call is queued
+    and replayed later by replay_pending_writes() instead of raising. While older
+    writes are still queued, new ones queue behind them to keep their order.
+    `timestamp_arg` names a keyword filled with the original call time.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _pending_writes and _replaying is None:
+                try:
+                    return func(*args, **kwargs)
+                except DatabaseUnavailable as e:
+                    logging.warning(f"Database unavailable, queueing {func.__name__}: {e}")
+            if timestamp_arg and kwargs.get(timestamp_arg) is None:
+                kwargs[timestamp_arg] = datetime.now(timezone.utc)
+            if len(_pending_writes) >= DB_WRITE_QUEUE_MAX:
+                logging.error(f"Write queue full ({DB_WRITE_QUEUE_MAX}), dropping {func.__name__}{args}")
+                return None
+            _pending_writes.append((func, args, kwargs))
+            return None
+        return wrapper
+    return decorator
+
+
+def pending_writes() -> int:
+    return len(_pending_writes) + (_replaying is not None)
+
+
+def replay_pending_writes() -> int:
+    """
+    Apply queued writes in order; stops at the first DatabaseUnavailable and leaves
+    the rest queued. Blocking, run it in a worker thread. Returns how many were applied.
+    """
+    global _replaying
+    replayed = 0
+    while _pending_writes:
+        # taken off the queue before it runs; new writes still queue behind it
+        _replaying = _pending_writes[0]
+        _pending_writes.popleft()
+        func, args, kwargs = _replaying
+        try:
+            func(*args, **kwargs)
+        except DatabaseUnavailable:
+            _pending_writes.appendleft(_replaying)
+            break
+        except Exception as e:
+            logging.error(f"Dropping queued {func.__name__}{args}: {e}")
+        finally:
+            _replaying = None
+        replayed += 1
+    if replayed:
+        # cached reports were computed without the replayed writes
+        stats_cache.invalidate()
+        logging.info(f"Replayed {replayed} queued writes, {len(_pending_writes)} left")
+    return replayed
+
 
+def init_db():
+    """Bring the schema up to date; see migrations.py."""
+    import migrations  # migrations imports this module
+    migrations.migrate()
+
+@replayable()
 def add_user(user_id, username):
     with get_connection() as conn, conn.cursor() as cursor:
         cursor.execute(
@@ -88,13 +403,16 @@ def add_user(user_id, username):
             (user_id, username, DEFAULT_DRINK),
         )
 
+@replayable()
 def set_desire(user_id, level):
     with get_connection() as conn, conn.cursor() as cursor:
-        cursor.execute('UPDATE users SET desire = %s WHERE user_id = %s', (level, user_id))
+        execute_prepared(cursor, "set_desire", (level, user_id))
 
 def get_all_users():
     with get_connection() as conn, conn.cursor() as cursor:
-        cursor.execute('SELECT user_id, username, desire, desire_type FROM users')
+        cursor.execute(
+            'SELECT user_id, username, desire, desire_type, tz, quiet_start, quiet_end FROM users'
+        )
         rows = cursor.fetchall()
     return [
         {
@@ -102,10 +420,14 @@ def get_all_users():
             "username": row["username"],
             "desire": row["desire"],
             "desire_type": row.get("desire_type") or DEFAULT_DRINK,
+            "tz": row["tz"],
+            "quiet_start": row["quiet_start"],
+            "quiet_end": row["quiet_end"],
         }
         for row in rows
     ]
 
+@replayable()
 def reset_desires():
     with get_connection() as conn, conn.cursor() as cursor:
         cursor.execute('UPDATE users SET desire = 0')
@@ -125,31 +447,62 @@ def get_user(user_id):
 
 def user_exists(user_id):
     with get_connection() as conn, conn.cursor() as cursor:
-        cursor.execute('SELECT 1 FROM users WHERE user_id = %s', (user_id,))
+        execute_prepared(cursor, "user_exists", (user_id,))
         exists = cursor.fetchone() is not None
     return exists
 
-def log_event(event_type, user_id=None, username=None, info=None):
+@replayable(timestamp_arg="created_at")
+def log_event(event_type, user_id=None, username=None, info=None,
+              level=None, drink=None, invite_code=None, created_at=None):
+    """
+    Insert an event; `drink` is a drink code and is stored as its SMALLINT id.
+    `created_at` defaults to the server's NOW().
+    """
+    drink_id = DRINK_IDS.get(drink) if drink is not None else None
     with get_connection() as conn, conn.cursor() as cursor:
-        cursor.execute(
-            'INSERT INTO events (event_type, user_id, username, info) VALUES (%s, %s, %s, %s)',
-            (event_type, user_id, username, info),
+        execute_prepared(
+            cursor, "log_event",
+            (event_type, user_id, username, info, level, drink_id, invite_code, created_at),
         )
+    if event_type in STATS_EVENT_TYPES:
+        stats_cache.invalidate()
 
-def create_invite(code, created_by):
+def create_invite(code, created_by, expires_at=None):
+    """Create or re-arm an invite; `expires_at` None means it never expires."""
     with get_connection() as conn, conn.cursor() as cursor:
         cursor.execute(
             """
-            INSERT INTO invites (code, created_by, active, used_by, used_at)
-            VALUES (%s, %s, TRUE, NULL, NULL)
+            INSERT INTO invites (code, created_by, active, used_by, used_at, expires_at)
+            VALUES (%s, %s, TRUE, NULL, NULL, %s)
             ON CONFLICT (code) DO UPDATE SET
                 created_by = EXCLUDED.created_by,
                 active = TRUE,
                 used_by = NULL,
-                used_at = NULL
+                used_at = NULL,
+                expires_at = EXCLUDED.expires_at
+            """,
+            (code, created_by, expires_at),
+        )
+
+def create_invites(codes, created_by, expires_at=None):
+    """
+    Insert many invites in one multi-row statement. Returns the codes that were
+    created; a code that already exists is skipped rather than re-armed.
+    """
+    with get_connection() as conn, conn.cursor() as cursor:
+        rows = psycopg2.extras.execute_values(
+            cursor,
+            """
+            INSERT INTO invites (code, created_by, active, expires_at)
+            VALUES %s
+            ON CONFLICT (code) DO NOTHING
+            RETURNING code
             """,
-            (code, created_by),
+            [(code, created_by, True, expires_at) for code in codes],
+            page_size=len(codes) or 1,
+            fetch=True,
         )
+    return [row["code"] for row in rows]
 
 def consume_invite(code, user_id, username):
     with get_connection() as conn, conn.cursor() as cursor:
@@ -158,6 +511,7 @@ def consume_invite(code, user_id, username):
             UPDATE invites
             SET active = FALSE, used_by = %s, used_at = NOW()
             WHERE code = %s AND active = TRUE AND used_by IS NULL
+              AND (expires_at IS NULL OR expires_at > NOW())
             RETURNING 1
             """,
             (user_id, code),
@@ -165,19 +519,46 @@ def consume_invite(code, user_id, username):
         row = cursor.fetchone()
     return row is not None
 
+def expire_invites(batch_size=INVITE_SWEEP_BATCH):
+    """
+    Deactivate expired, unused invites, `batch_size` rows per statement so the
+    sweep never holds many row locks at once. Returns how many were deactivated.
+    """
+    # = ANY(ARRAY(...)) looks the batch up by primary key; `code IN (...)` is
+    # planned as a hash join over a full scan of invites
+    total = 0
+    while True:
+        with get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE invites SET active = FALSE
+                WHERE code = ANY(ARRAY(
+                    SELECT code FROM invites
+                    WHERE active AND used_by IS NULL AND expires_at <= NOW()
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ))
+                """,
+                (batch_size,),
+            )
+            swept = cursor.rowcount
+        total += swept
+        if swept < batch_size:
+            return total
+
 def get_coffee_events_since(days: int = 7):
-    with get_connection() as conn, conn.cursor() as cursor:
-        cursor.execute(
-            '''
-            SELECT created_at FROM events
-            WHERE event_type = 'coffee_consumed'
-              AND created_at >= NOW() - INTERVAL %s
-            ORDER BY created_at ASC
-            ''',
-            (f'{days} days',),
-        )
-        rows = cursor.fetchall()
-    return [row["created_at"] for row in rows]
+    """Yields coffee_consumed timestamps of the last N days in ascending order."""
+    rows = iter_query(
+        '''
+        SELECT created_at FROM events
+        WHERE event_type = 'coffee_consumed'
+          AND created_at >= NOW() - INTERVAL %s
+        ORDER BY created_at ASC
+        ''',
+        (f'{days} days',),
+        read_only=True,
+    )
+    return (row[0] for row in rows)
 
 def weekly_coffee_stats():
     """Returns count and gap metrics for last 7 days."""
@@ -185,61 +566,64 @@ def weekly_coffee_stats():
     return compute_gap_stats(events)
 
 def get_all_coffee_events():
-    with get_connection() as conn, conn.cursor() as cursor:
-        cursor.execute(
-            '''
-            SELECT created_at FROM events
-            WHERE event_type = 'coffee_consumed'
-            ORDER BY created_at ASC
-            '''
-        )
-        rows = cursor.fetchall()
-    return [row["created_at"] for row in rows]
+    """Yields all coffee_consumed timestamps in ascending order."""
+    rows = iter_query(
+        '''
+        SELECT created_at FROM events
+        WHERE event_type = 'coffee_consumed'
+        ORDER BY created_at ASC
+        ''',
+        read_only=True,
+    )
+    return (row[0] for row in rows)
 
 def compute_gap_stats(event_timestamps):
-    """Given list of timestamp objects/strings, compute count and gap metrics."""
-    count = len(event_timestamps)
-    if count == 0:
-        return {
-            "count": 0,
-            "shortest_gap": None,
-            "longest_gap": None,
-            "average_gap": None,
-            "first_at": None,
-            "last_at": None,
-        }
+    """
+    Compute count and gap metrics for timestamp objects/strings in one pass and
+    constant memory. Iterators must be in ascending order (as the event queries
+    return them); lists and tuples are sorted first.
+    """
+    def as_datetime(ts):
+        return ts if isinstance(ts, datetime) else datetime.fromisoformat(str(ts))
+
+    if isinstance(event_timestamps, (list, tuple)):
+        event_timestamps = sorted(as_datetime(ts) for ts in event_timestamps)
 
-    times = []
+    count = 0
+    first_at = last_at = None
+    shortest_gap = longest_gap = None
     for ts in event_timestamps:
-        if isinstance(ts, datetime):
-            times.append(ts)
+        ts = as_datetime(ts)
+        if last_at is None:
+            first_at = ts
         else:
-            times.append(datetime.fromisoformat(str(ts)))
-
-    times = sorted(times)
-    if count == 1:
+            gap = (ts - last_at).total_seconds()
+            if shortest_gap is None or gap < shortest_gap:
+                shortest_gap = gap
+            if longest_gap is None or gap > longest_gap:
+                longest_gap = gap
+        last_at = ts
+        count += 1
+
+    if count < 2:
         return {
-            "count": 1,
+            "count": count,
             "shortest_gap": None,
             "longest_gap": None,
             "average_gap": None,
-            "first_at": times[0],
-            "last_at": times[0],
+            "first_at": first_at,
+            "last_at": last_at,
         }
 
-    gaps = []
-    for prev, cur in zip(times, times[1:]):
-        diff = (cur - prev).total_seconds()
-        gaps.append(diff)
-
-    avg_gap = sum(gaps) / len(gaps) if gaps else None
+    # the gaps telescope, so their mean is the total span over the gap count
+    average_gap = (last_at - first_at).total_seconds() / (count - 1)
     return {
         "count": count,
-        "shortest_gap": int(min(gaps)) if gaps else None,
-        "longest_gap": int(max(gaps)) if gaps else None,
-        "average_gap": int(avg_gap) if avg_gap is not None else None,
-        "first_at": times[0],
-        "last_at": times[-1],
+        "shortest_gap": int(shortest_gap),
+        "longest_gap": int(longest_gap),
+        "average_gap": int(average_gap),
+        "first_at": first_at,
+        "last_at": last_at,
     }
 
 def all_time_coffee_stats():
@@ -249,14 +633,27 @@ def all_time_coffee_stats():
 # -------- Settings helpers --------
 
 def get_setting(key, default=None):
-    with get_connection() as conn, conn.cursor() as cursor:
-        cursor.execute('SELECT value FROM settings WHERE key = %s', (key,))
-        row = cursor.fetchone()
-    if row is None:
-        return default
-    return row["value"]
+    """Falls back to the last value read or written while the database is unavailable."""
+    if pending_writes() and key in _settings_snapshot:
+        # a queued set_setting is newer than what the table holds
+        value = _settings_snapshot[key]
+        return default if value is None else value
+    try:
+        with get_connection() as conn, conn.cursor() as cursor:
+            execute_prepared(cursor, "get_setting", (key,))
+            row = cursor.fetchone()
+    except DatabaseUnavailable:
+        value = _settings_snapshot.get(key)
+        return default if value is None else value
+    value = _settings_snapshot[key] = row["value"] if row else None
+    return default if value is None else value
 
 def set_setting(key, value):
+    _settings_snapshot[key] = str(value)
+    _set_setting(key, value)
+
+@replayable()
+def _set_setting(key, value):
     with get_connection() as conn, conn.cursor() as cursor:
         cursor.execute(
             '''
@@ -266,25 +663,25 @@ def set_setting(key, value):
             (key, str(value)),
         )
 
-def ensure_default_settings():
+# -------- Quiet hours --------
+
+@replayable()
+def set_user_timezone(user_id, tz):
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute('UPDATE users SET tz = %s WHERE user_id = %s', (tz, user_id))
+
+@replayable()
+def set_user_quiet_hours(user_id, start, end):
+    """Quiet window in the user's local hours; None/None restores the default window."""
     with get_connection() as conn, conn.cursor() as cursor:
         cursor.execute(
-            '''
-            INSERT INTO settings (key, value) VALUES (%s, %s)
-            ON CONFLICT (key) DO NOTHING
-            ''',
-            ('threshold', DEFAULT_THRESHOLD),
-        )
-        cursor.execute(
-            '''
-            INSERT INTO settings (key, value) VALUES (%s, %s)
-            ON CONFLICT (key) DO NOTHING
-            ''',
-            ('prompt_interval', DEFAULT_PROMPT_INTERVAL),
+            'UPDATE users SET quiet_start = %s, quiet_end = %s WHERE user_id = %s',
+            (start, end, user_id),
         )
 
 # -------- Drink helpers --------
 
+@replayable()
 def set_desire_type(user_id, drink_code):
     with get_connection() as conn, conn.cursor() as cursor:
         cursor.execute('UPDATE users SET desire_type = %s WHERE user_id = %s', (drink_code, user_id))
@@ -307,48 +704,54 @@ def user_weekly_stats(days: int = 7):
     - consumed_total: coffee_consumed events
     - consumed_by_drink: coffee_consumed grouped by drink
     """
-    with get_connection() as conn, conn.cursor() as cursor:
-        cursor.execute(
-            '''
-            SELECT user_id, username, event_type, info
-            FROM events
-            WHERE created_at >= NOW() - INTERVAL %s
-            ''',
-            (f'{days} days',),
-        )
-        rows = cursor.fetchall()
+    conn = get_read_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                '''
+                SELECT user_id, max(username) AS username, event_type, drink, count(*) AS cnt
+                FROM events
+                WHERE created_at >= NOW() - INTERVAL %s
+                  AND user_id IS NOT NULL
+                  AND event_type IN ('set_desire', 'set_drink', 'coffee_consumed')
+                GROUP BY user_id, event_type, drink
+                ''',
+                (f'{days} days',),
+            )
+            rows = cursor.fetchall()
+    except UNAVAILABLE_ERRORS as e:
+        raise DatabaseUnavailable(str(e)) from e
+    finally:
+        conn.close()
 
-    def parse_drink(info_value):
-        if not info_value:
-            return DEFAULT_DRINK
-        if info_value.startswith('drink:'):
-            return info_value.split(':', 1)[1]
-        return info_value
+    return fold_user_stats(rows)
 
+def fold_user_stats(rows):
+    """Fold (user_id, username, event_type, drink, cnt) rows into per-user stats dicts."""
     stats = {}
-    for user_id, username, event_type, info in rows:
-        if user_id is None:
-            continue
+    for row in rows:
+        user_id = row["user_id"]
         if user_id not in stats:
             stats[user_id] = {
                 'user_id': user_id,
-                'username': username,
+                'username': row["username"],
                 'want_count': 0,
                 'drink_selects': {},
                 'consumed_total': 0,
                 'consumed_by_drink': {},
             }
         entry = stats[user_id]
+        event_type = row["event_type"]
+        cnt = row["cnt"]
+        drink = DRINK_CODES.get(row["drink"], DEFAULT_DRINK)
 
         if event_type == 'set_desire':
-            entry['want_count'] += 1
+            entry['want_count'] += cnt
         elif event_type == 'set_drink':
-            drink = parse_drink(info)
-            entry['drink_selects'][drink] = entry['drink_selects'].get(drink, 0) + 1
+            entry['drink_selects'][drink] = entry['drink_selects'].get(drink, 0) + cnt
         elif event_type == 'coffee_consumed':
-            drink = parse_drink(info)
-            entry['consumed_total'] += 1
-            entry['consumed_by_drink'][drink] = entry['consumed_by_drink'].get(drink, 0) + 1
+            entry['consumed_total'] += cnt
+            entry['consumed_by_drink'][drink] = entry['consumed_by_drink'].get(drink, 0) + cnt
 
     return list(stats.values())
 
@@ -0,0 +1,61 @@
+"""Deferred delivery of notifications suppressed by quiet hours.
+
+Each chat keeps at most one pending notification: a newer one replaces the older
+(latest state only). The bot flushes chats whose quiet window has ended at a
+limited rate, so a morning does not turn into one burst of sends.
+"""
+import asyncio
+import logging
+import os
+
+DEFERRED_FLUSH_INTERVAL = int(os.getenv("DEFERRED_FLUSH_INTERVAL", "60"))  # seconds
+DEFERRED_FLUSH_RATE = float(os.getenv("DEFERRED_FLUSH_RATE", "5"))  # messages per second
+
+
+class Notification:
+    __slots__ = ("kind", "text", "reply_markup", "allow_multiple")
+
+    def __init__(self, kind, text, reply_markup=None, allow_multiple=False):
+        self.kind = kind
+        self.text = text
+        self.reply_markup = reply_markup
+        self.allow_multiple = allow_multiple
+
+
+class DeferredQueue:
+    def __init__(self):
+        self._pending = {}  # chat_id -> Notification
+
+    def __len__(self):
+        return len(self._pending)
+
+    def defer(self, chat_id, notification: Notification):
+        self._pending[chat_id] = notification
+
+    def clear(self):
+        self._pending.clear()
+
+    async def flush(self, is_quiet, send, rate: float = DEFERRED_FLUSH_RATE) -> int:
+        """
+        Send pending notifications for chats where `is_quiet(chat_id)` is now False,
+        spacing sends by 1/rate seconds. Returns how many were delivered.
+        """
+        delivered = 0
+        for chat_id in [c for c in self._pending if not is_quiet(c)]:
+            notification = self._pending.pop(chat_id, None)
+            if notification is None:
+                continue  # replaced-and-flushed or cleared while we were sleeping
+            try:
+                await send(chat_id, notification)
+                delivered += 1
+            except Exception as e:
+                logging.error(f"Failed to deliver deferred {notification.kind} to {chat_id}: {e}")
+            if rate > 0:
+                await asyncio.sleep(1 / rate)
+        return delivered
+
+    async def run(self, is_quiet, send, interval: int = DEFERRED_FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            if self._pending:
+                await self.flush(is_quiet, send)
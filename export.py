@@ -0,0 +1,173 @@
+"""Bulk export of events and users for offline analysis.
+
+Rows are streamed with `COPY (...) TO STDOUT` straight into gzip-compressed CSV
+files on disk, so memory use does not depend on table size. The read goes to the
+read replica when one is configured (see database.get_read_connection), never
+through the bot's connection pool, under DB_EXPORT_STATEMENT_TIMEOUT instead of
+the stats reports' timeout. Timestamps are written in UTC with an explicit
+offset. With pyarrow installed the CSV files can be converted to Parquet, again
+batch by batch.
+
+    python export.py /tmp/out --since 2026-01-01 --until 2026-01-31 --format parquet
+"""
+import gzip
+import logging
+import os
+from datetime import datetime, timezone
+
+import database
+
+EXPORT_FORMATS = ("csv", "parquet")
+COMPRESS_LEVEL = 6
+PARQUET_BLOCK_SIZE = 1 << 22  # bytes of CSV parsed per Parquet row batch
+# pyarrow type aliases per exported column, so types never depend on which rows
+# happen to come first (a column that is all NULL in one block is still typed);
+# "timestamptz" is a UTC timestamp, which has no pyarrow alias
+COLUMN_TYPES = {
+    "events": {
+        "id": "int64",
+        "event_type": "string",
+        "user_id": "int64",
+        "username": "string",
+        "info": "string",
+        "level": "int16",
+        "drink": "string",
+        "invite_code": "string",
+        "created_at": "timestamptz",
+    },
+    "users": {
+        "user_id": "int64",
+        "username": "string",
+        "desire": "int32",
+        "desire_type": "string",
+        "tz": "string",
+        "quiet_start": "int16",
+        "quiet_end": "int16",
+        "created_at": "timestamptz",
+    },
+}
+
+
+def events_query(cursor, since: datetime | None = None, until: datetime | None = None) -> bytes:
+    """SELECT for COPY; COPY takes no bind parameters, so values are inlined with mogrify."""
+    drinks = ", ".join(
+        cursor.mogrify("(%s, %s)", (drink_id, code)).decode() for code, drink_id in database.DRINK_IDS.items()
+    )
+    return cursor.mogrify(
+        f"""
+        SELECT e.id, e.event_type, e.user_id, e.username, e.info, e.level,
+               d.code AS drink, e.invite_code,
+               e.created_at
+        FROM events e
+        LEFT JOIN (VALUES {drinks}) AS d(drink_id, code) ON d.drink_id = e.drink
+        WHERE (%s::timestamptz IS NULL OR e.created_at >= %s)
+          AND (%s::timestamptz IS NULL OR e.created_at < %s)
+        ORDER BY e.id
+        """,
+        (since, since, until, until),
+    )
+
+
+def users_query(cursor) -> bytes:
+    return cursor.mogrify(
+        """
+        SELECT user_id, username, desire, desire_type, tz, quiet_start, quiet_end, created_at
+        FROM users
+        ORDER BY user_id
+        """
+    )
+
+
+def copy_to_csv_gz(conn, query: bytes, path: str) -> int:
+    """Stream `query` into a gzip CSV file at `path`; returns the compressed size in bytes."""
+    with gzip.open(path, "wb", compresslevel=COMPRESS_LEVEL) as out, conn.cursor() as cursor:
+        cursor.copy_expert(b"COPY (" + query + b") TO STDOUT WITH (FORMAT csv, HEADER)", out)
+    return os.path.getsize(path)
+
+
+def _arrow_type(pyarrow, alias: str):
+    if alias == "timestamptz":
+        return pyarrow.timestamp("us", tz="UTC")
+    return pyarrow.type_for_alias(alias)
+
+
+def csv_gz_to_parquet(csv_path: str, parquet_path: str, table: str) -> bool:
+    """Convert one exported CSV file to Parquet; False when pyarrow is not installed."""
+    try:
+        import pyarrow
+        import pyarrow.csv
+        import pyarrow.parquet
+    except ImportError:
+        logging.info("pyarrow is not installed; exporting CSV only")
+        return False
+    with gzip.open(csv_path, "rb") as source:
+        reader = pyarrow.csv.open_csv(
+            source,
+            read_options=pyarrow.csv.ReadOptions(block_size=PARQUET_BLOCK_SIZE),
+            convert_options=pyarrow.csv.ConvertOptions(
+                column_types={
+                    name: _arrow_type(pyarrow, alias) for name, alias in COLUMN_TYPES[table].items()
+                },
+                strings_can_be_null=True,
+            ),
+        )
+        with pyarrow.parquet.ParquetWriter(parquet_path, reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+    return True
+
+
+def export(directory: str, fmt: str = "csv", since: datetime | None = None,
+           until: datetime | None = None) -> list[str]:
+    """
+    Export events (created in [since, until)) and all users into `directory`.
+    Blocking, run it in a worker thread. Returns the paths of the written files.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}")
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    paths = {}
+    conn = database.get_read_connection()
+    try:
+        # one snapshot for both tables
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True, autocommit=False)
+        with conn.cursor() as cursor:
+            # timestamptz is printed in the session time zone, with its offset
+            cursor.execute("SET LOCAL TIME ZONE 'UTC'")
+            cursor.execute("SET LOCAL statement_timeout = %s", (database.DB_EXPORT_STATEMENT_TIMEOUT,))
+            queries = {"events": events_query(cursor, since, until), "users": users_query(cursor)}
+        for table, query in queries.items():
+            path = os.path.join(directory, f"{table}-{stamp}.csv.gz")
+            copy_to_csv_gz(conn, query, path)
+            paths[table] = path
+        conn.rollback()
+    except database.UNAVAILABLE_ERRORS as e:
+        raise database.DatabaseUnavailable(str(e)) from e
+    finally:
+        conn.close()
+
+    if fmt == "parquet":
+        for table, path in paths.items():
+            parquet_path = path[: -len(".csv.gz")] + ".parquet"
+            if not csv_gz_to_parquet(path, parquet_path, table):
+                break
+            os.remove(path)
+            paths[table] = parquet_path
+    return list(paths.values())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def day(value):
+        return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--since", type=day, help="UTC date, inclusive")
+    parser.add_argument("--until", type=day, help="UTC date, exclusive")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for path in export(args.directory, args.format, args.since, args.until):
+        print(f"{path}  {os.path.getsize(path)} bytes")
@@ -0,0 +1,160 @@
+"""Event-loop lag monitor and slow-handler detector.
+
+A heartbeat task measures how late the loop wakes it up (loop lag). A helper
+thread watches the heartbeat; while the loop is stalled it grabs the loop
+thread's stack and the label of the task that is running, so the heartbeat can
+report who blocked the loop once it wakes up again. Handlers and scheduler
+iterations wrapped in `track()` are also reported when their wall time exceeds
+SLOW_HANDLER_THRESHOLD. Reports are logged and kept in an in-process ring buffer.
+"""
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))  # seconds
+SLOW_HANDLER_THRESHOLD = float(os.getenv("SLOW_HANDLER_THRESHOLD", "2"))  # seconds
+WATCHDOG_INTERVAL = 0.1  # seconds between heartbeats
+REPORT_BUFFER_SIZE = int(os.getenv("WATCHDOG_BUFFER_SIZE", "200"))
+STACK_LIMIT = 30  # innermost frames kept in a stack sample
+SUMMARY_REPORTS = 10  # reports listed by summary()
+
+reports = collections.deque(maxlen=REPORT_BUFFER_SIZE)
+max_lag = 0.0
+last_lag = 0.0
+
+# task -> label of the handler it is running ("callback:level", "scheduler", ...)
+_task_labels = weakref.WeakKeyDictionary()
+# bumped by every heartbeat; the monitor thread samples once per stalled beat
+_beat = 0
+_beat_at = time.monotonic()
+# (beat, label, stack) captured by the monitor thread during the current stall
+_stall_sample = None
+_heartbeat_task = None
+
+
+def recent_reports(limit: int | None = None, kind: str | None = None) -> list[dict]:
+    """Newest-first reports, optionally filtered by kind ("loop_stall"/"slow_handler")."""
+    items = [r for r in reversed(reports) if kind is None or r["kind"] == kind]
+    return items if limit is None else items[:limit]
+
+
+def summary(limit: int = SUMMARY_REPORTS) -> str:
+    """Lag figures and the newest reports, each with the innermost frame of its stack."""
+    lines = [
+        f"Задержка цикла событий: сейчас {last_lag * 1000:.0f} мс, максимум {max_lag * 1000:.0f} мс",
+        f"Порог зависания {LOOP_LAG_THRESHOLD:.2f} с, медленного обработчика {SLOW_HANDLER_THRESHOLD:.0f} с",
+        "",
+    ]
+    items = recent_reports(limit)
+    if not items:
+        lines.append("Зависаний и медленных обработчиков не было.")
+    for report in items:
+        kind = "зависание" if report["kind"] == "loop_stall" else "медленно"
+        lines.append(f"{report['at']:%d.%m %H:%M:%S}  {kind} {report['duration']:.2f} с  {report['label']}")
+        if report["stack"]:
+            # the innermost frame is the call that held the loop
+            lines += ["    " + line.strip() for line in report["stack"].rstrip().splitlines()[-2:]]
+    return "\n".join(lines)
+
+
+def _record(kind: str, label: str, duration: float, stack: str | None = None):
+    report = {
+        "kind": kind,
+        "label": label,
+        "duration": round(duration, 3),
+        "at": datetime.now(),
+        "stack": stack,
+    }
+    reports.append(report)
+    message = f"{kind}: {label} took {duration:.3f}s"
+    if stack:
+        message += f"\n{stack}"
+    logging.warning(message)
+
+
+@contextmanager
+def track(label: str):
+    """Attribute work done by the current task to `label` and report it if slow."""
+    task = asyncio.current_task()
+    previous = _task_labels.get(task) if task is not None else None
+    if task is not None:
+        _task_labels[task] = label
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = time.monotonic() - started
+        if task is not None:
+            if previous is None:
+                _task_labels.pop(task, None)
+            else:
+                _task_labels[task] = previous
+        if duration > SLOW_HANDLER_THRESHOLD:
+            _record("slow_handler", label, duration)
+
+
+def _task_label(task) -> str:
+    if task is None:
+        return "event loop (no task)"
+    return _task_labels.get(task) or task.get_name()
+
+
+def _monitor(loop, loop_thread_id: int):
+    global _stall_sample
+    sampled_beat = None
+    while not loop.is_closed():
+        time.sleep(WATCHDOG_INTERVAL)
+        beat, beat_at = _beat, _beat_at
+        if beat == sampled_beat or time.monotonic() - beat_at < LOOP_LAG_THRESHOLD:
+            continue
+        frame = sys._current_frames().get(loop_thread_id)
+        stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame else ""
+        try:
+            label = _task_label(asyncio.current_task(loop))
+        except RuntimeError:
+            label = "unknown"
+        _stall_sample = (beat, label, stack)
+        sampled_beat = beat
+
+
+async def _heartbeat():
+    global _beat, _beat_at, max_lag, last_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + WATCHDOG_INTERVAL
+        await asyncio.sleep(WATCHDOG_INTERVAL)
+        lag = max(0.0, loop.time() - expected)
+        sample = _stall_sample
+        _beat += 1
+        _beat_at = time.monotonic()
+        last_lag = lag
+        max_lag = max(max_lag, lag)
+        if lag > LOOP_LAG_THRESHOLD:
+            if sample is not None and sample[0] == _beat - 1:
+                _record("loop_stall", sample[1], lag, sample[2])
+            else:
+                _record("loop_stall", "unknown", lag)
+
+
+def start():
+    """Start the heartbeat task and the monitor thread for the running loop."""
+    global _heartbeat_task, _beat_at
+    if _heartbeat_task is not None and not _heartbeat_task.done():
+        return
+    loop = asyncio.get_running_loop()
+    _beat_at = time.monotonic()
+    _heartbeat_task = loop.create_task(_heartbeat(), name="watchdog-heartbeat")
+    threading.Thread(
+        target=_monitor,
+        args=(loop, threading.get_ident()),
+        name="watchdog-monitor",
+        daemon=True,
+    ).start()
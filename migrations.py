@@ -0,0 +1,218 @@
+"""Ordered schema migrations tracked in the `schema_version` table.
+
+To change the schema append a new `(version, description, function)` entry to
+MIGRATIONS; never edit or renumber a migration that has already shipped.
+"""
+import logging
+
+import database
+
+# pg_advisory_lock key shared by every bot replica running migrations
+MIGRATION_LOCK_KEY = 0xC0FFEE
+
+
+def _initial_schema(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            desire INTEGER DEFAULT 0,
+            desire_type TEXT DEFAULT 'coffee',
+            created_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            id BIGSERIAL PRIMARY KEY,
+            event_type TEXT NOT NULL,
+            user_id BIGINT,
+            username TEXT,
+            info TEXT,
+            created_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS events_created_at_idx ON events(created_at)"
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS invites (
+            code TEXT PRIMARY KEY,
+            created_by BIGINT,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            used_by BIGINT,
+            used_at TIMESTAMPTZ,
+            active BOOLEAN DEFAULT TRUE
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO settings (key, value) VALUES (%s, %s), (%s, %s)
+        ON CONFLICT (key) DO NOTHING
+        """,
+        (
+            'threshold', database.DEFAULT_THRESHOLD,
+            'prompt_interval', database.DEFAULT_PROMPT_INTERVAL,
+        ),
+    )
+
+
+def _typed_event_columns(cursor):
+    cursor.execute(
+        """
+        ALTER TABLE events
+            ADD COLUMN IF NOT EXISTS level SMALLINT,
+            ADD COLUMN IF NOT EXISTS drink SMALLINT,
+            ADD COLUMN IF NOT EXISTS invite_code TEXT
+                REFERENCES invites(code) ON DELETE SET NULL
+        """
+    )
+
+
+def _backfill_event_columns(cursor):
+    """Move legacy `events.info` strings into the typed columns."""
+    # level:7 / adjust:7 -> level; info keeps only the "adjust" origin marker
+    cursor.execute(
+        r"""
+        UPDATE events
+        SET level = substring(info FROM ':(\d+)$')::SMALLINT,
+            info = CASE WHEN info LIKE 'adjust:%' THEN 'adjust' END
+        WHERE event_type = 'set_desire'
+          AND level IS NULL
+          AND info ~ '^(level|adjust):\d+$'
+        """
+    )
+    # drink:latte / latte -> drink id
+    cursor.execute(
+        """
+        UPDATE events e
+        SET drink = d.drink_id, info = NULL
+        FROM unnest(%s::TEXT[], %s::SMALLINT[]) AS d(code, drink_id)
+        WHERE e.event_type IN ('set_drink', 'coffee_consumed')
+          AND e.drink IS NULL
+          AND regexp_replace(e.info, '^drink:', '') = d.code
+        """,
+        (list(database.DRINK_IDS.keys()), list(database.DRINK_IDS.values())),
+    )
+    cursor.execute(
+        """
+        UPDATE events e
+        SET invite_code = e.info, info = NULL
+        WHERE e.event_type IN ('invite_created', 'invite_used')
+          AND e.invite_code IS NULL
+          AND EXISTS (SELECT 1 FROM invites i WHERE i.code = e.info)
+        """
+    )
+
+
+def _user_quiet_hours(cursor):
+    cursor.execute(
+        """
+        ALTER TABLE users
+            ADD COLUMN IF NOT EXISTS tz TEXT,
+            ADD COLUMN IF NOT EXISTS quiet_start SMALLINT,
+            ADD COLUMN IF NOT EXISTS quiet_end SMALLINT
+        """
+    )
+
+
+def _invite_expiry(cursor):
+    cursor.execute("ALTER TABLE invites ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ")
+    # only live invites are looked up (consume_invite) or swept (expire_invites)
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS invites_live_expires_at_idx
+        ON invites (expires_at)
+        WHERE active AND used_by IS NULL
+        """
+    )
+
+
+def _event_type_index(cursor):
+    # coffee stats and analytics filter on event_type and read in created_at
+    # order; events_created_at_idx alone walks every event type
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS events_type_created_at_idx
+        ON events (event_type, created_at)
+        """
+    )
+
+
+MIGRATIONS = [
+    (1, "initial schema and default settings", _initial_schema),
+    (2, "typed event columns", _typed_event_columns),
+    (3, "backfill typed event columns", _backfill_event_columns),
+    (4, "per-user timezone and quiet hours", _user_quiet_hours),
+    (5, "invite expiry and live-invite index", _invite_expiry),
+    (6, "events (event_type, created_at) index", _event_type_index),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cursor) -> int:
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL AS present")
+    if not cursor.fetchone()["present"]:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version")
+    return cursor.fetchone()["version"]
+
+
+def migrate():
+    """Apply pending migrations; a no-op (two cheap reads) when the schema is current."""
+    conn = database.connect()
+    try:
+        with conn.cursor() as cursor:
+            if current_version(cursor) >= LATEST_VERSION:
+                return
+            # serialise concurrent replicas; re-check once we own the lock
+            cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            try:
+                cursor.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at TIMESTAMPTZ DEFAULT NOW()
+                    )
+                    """
+                )
+                version = current_version(cursor)
+                conn.autocommit = False
+                for number, description, apply in MIGRATIONS:
+                    if number <= version:
+                        continue
+                    logging.info(f"Applying migration {number}: {description}")
+                    apply(cursor)
+                    cursor.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                        (number, description),
+                    )
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.autocommit = True
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    print(f"Schema at version {LATEST_VERSION}.")
@@ -0,0 +1,127 @@
+"""On-demand sampling profiler for the running bot.
+
+A helper thread samples the Python stacks of every other thread (the event loop
+plus the worker threads running blocking database calls) at a fixed interval.
+Samples are aggregated as collapsed stacks ("root;caller;callee count"), the
+format flamegraph.pl and speedscope read directly.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+SAMPLE_INTERVAL = 0.005  # seconds
+MAX_PROFILE_SECONDS = 120
+TOP_FUNCTIONS = 10
+# innermost frames that mean "waiting for work", not "busy"
+IDLE_FRAMES = {
+    "selectors.py:select",
+    "threading.py:wait",
+    "thread.py:_worker",
+    "loop_watchdog.py:_monitor",
+    # uvloop runs the loop in C: between callbacks the loop thread's innermost
+    # Python frame is asyncio.Runner.run
+    "runners.py:run",
+}
+DATABASE_FILE = "database.py"
+BOT_API_MARKERS = ("aiogram", "aiohttp")
+
+_lock = threading.Lock()
+
+
+def is_running() -> bool:
+    return _lock.locked()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _frame_key(frame) -> str:
+    """Label plus enough of the path to tell aiogram/aiohttp frames apart."""
+    code = frame.f_code
+    path = code.co_filename
+    for marker in BOT_API_MARKERS:
+        if f"{os.sep}{marker}{os.sep}" in path:
+            return f"{marker}/{os.path.basename(path)}:{code.co_name}"
+    return _frame_label(frame)
+
+
+def profile(seconds: float, interval: float = SAMPLE_INTERVAL) -> dict:
+    """Sample all other threads for `seconds`; blocking, run it in a worker thread."""
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("profiler is already running")
+    try:
+        own_id = threading.get_ident()
+        stacks = collections.Counter()
+        samples = idle = 0
+        started = time.monotonic()
+        deadline = started + min(seconds, MAX_PROFILE_SECONDS)
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if _frame_label(frame) in IDLE_FRAMES:
+                    idle += 1
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(_frame_key(frame))
+                    frame = frame.f_back
+                names.reverse()
+                stacks[";".join(names)] += 1
+                samples += 1
+            time.sleep(interval)
+        return {
+            "stacks": stacks,
+            "samples": samples,
+            "idle_samples": idle,
+            "interval": interval,
+            "duration": time.monotonic() - started,
+        }
+    finally:
+        _lock.release()
+
+
+def collapsed(result: dict) -> str:
+    """Collapsed-stack text for flamegraph tools."""
+    return "".join(f"{stack} {count}\n" for stack, count in result["stacks"].most_common())
+
+
+def function_totals(result: dict):
+    """(self, inclusive) sample counts per function."""
+    self_counts = collections.Counter()
+    inclusive = collections.Counter()
+    for stack, count in result["stacks"].items():
+        names = stack.split(";")
+        self_counts[names[-1]] += count
+        for name in set(names):
+            inclusive[name] += count
+    return self_counts, inclusive
+
+
+def summary(result: dict, top: int = TOP_FUNCTIONS) -> str:
+    samples = result["samples"]
+    if samples == 0:
+        return f"Профиль {result['duration']:.0f} с: активных сэмплов нет, бот простаивал."
+    self_counts, inclusive = function_totals(result)
+
+    def line(name, count):
+        return f"{count * 100 / samples:5.1f}%  {name}"
+
+    lines = [
+        f"Профиль {result['duration']:.0f} с: {samples} активных сэмплов "
+        f"(+{result['idle_samples']} простоя), шаг {result['interval'] * 1000:.0f} мс",
+        "",
+        "Самые горячие функции (self):",
+    ]
+    lines += [line(name, count) for name, count in self_counts.most_common(top)]
+    db = [(n, c) for n, c in inclusive.most_common() if n.startswith(DATABASE_FILE + ":")]
+    lines += ["", "database.py (inclusive):"]
+    lines += [line(name, count) for name, count in db[:top]] or ["—"]
+    api = [(n, c) for n, c in inclusive.most_common() if n.startswith(tuple(f"{m}/" for m in BOT_API_MARKERS))]
+    lines += ["", "Bot API / aiogram + aiohttp (inclusive):"]
+    lines += [line(name, count) for name, count in api[:top]] or ["—"]
+    return "\n".join(lines)
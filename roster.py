@@ -0,0 +1,118 @@
+"""In-memory roster of members mirroring the users table.
+
+Loaded once from the database, then kept current by applying the same writes the
+handlers make (set desire, set drink, reset). It is fully reloaded every
+ROSTER_REFRESH_INTERVAL seconds to pick up changes made by other bot replicas.
+While the database is unavailable the last loaded roster keeps being served.
+"""
+import logging
+import os
+import time
+
+import database
+
+ROSTER_REFRESH_INTERVAL = int(os.getenv("ROSTER_REFRESH_INTERVAL", "300"))  # seconds
+
+
+class Member:
+    __slots__ = ("user_id", "username", "desire", "desire_type", "tz", "quiet_start", "quiet_end")
+
+    def __init__(self, user_id, username, desire=0, desire_type=database.DEFAULT_DRINK,
+                 tz=None, quiet_start=None, quiet_end=None):
+        self.user_id = user_id
+        self.username = username
+        self.desire = desire
+        self.desire_type = desire_type
+        # None means "use the bot-wide default"
+        self.tz = tz
+        self.quiet_start = quiet_start
+        self.quiet_end = quiet_end
+
+
+class Roster:
+    """
+    Members in registration order. Iteration walks a list, so members added while
+    a broadcast is awaiting sends are simply picked up instead of raising.
+    """
+
+    def __init__(self):
+        self._members = []
+        self._by_id = {}
+        self.loaded_at = None
+
+    def refresh(self):
+        members = [
+            Member(
+                u["user_id"], u["username"], u["desire"], u["desire_type"],
+                u["tz"], u["quiet_start"], u["quiet_end"],
+            )
+            for u in database.get_all_users()
+        ]
+        self._members = members
+        self._by_id = {m.user_id: m for m in members}
+        self.loaded_at = time.monotonic()
+
+    def ensure_fresh(self, max_age: int = ROSTER_REFRESH_INTERVAL):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > max_age:
+            try:
+                self.refresh()
+            except database.DatabaseUnavailable as e:
+                if self.loaded_at is None:
+                    raise
+                logging.warning(f"Roster refresh skipped, serving the last snapshot: {e}")
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def __len__(self):
+        return len(self._members)
+
+    def get(self, user_id):
+        return self._by_id.get(user_id)
+
+    def upsert(self, user_id, username):
+        member = self._by_id.get(user_id)
+        if member is None:
+            member = Member(user_id, username)
+            self._members.append(member)
+            self._by_id[user_id] = member
+        else:
+            member.username = username
+        return member
+
+    def set_desire(self, user_id, level):
+        member = self._by_id.get(user_id)
+        if member is not None:
+            member.desire = level
+
+    def set_drink(self, user_id, drink_code):
+        member = self._by_id.get(user_id)
+        if member is not None:
+            member.desire_type = drink_code
+
+    def set_timezone(self, user_id, tz):
+        member = self._by_id.get(user_id)
+        if member is not None:
+            member.tz = tz
+
+    def set_quiet_hours(self, user_id, start, end):
+        member = self._by_id.get(user_id)
+        if member is not None:
+            member.quiet_start = start
+            member.quiet_end = end
+
+    def reset_desires(self):
+        for member in self._members:
+            member.desire = 0
+
+    def not_ready(self, threshold):
+        return (m for m in self._members if m.desire < threshold)
+
+    def all_ready(self, threshold) -> bool:
+        """True when there is at least one member and every member is at/above threshold."""
+        if not self._members:
+            return False
+        for member in self._members:
+            if member.desire < threshold:
+                return False
+        return True
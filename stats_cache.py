@@ -0,0 +1,58 @@
+"""TTL cache for the stats screens with single-flight computation.
+
+Entries are keyed by (report, window). Logging an event the reports read
+(database.STATS_EVENT_TYPES) invalidates everything (see database.log_event);
+concurrent requests for the same key while it is being computed share one
+computation.
+"""
+import asyncio
+import os
+import time
+
+STATS_CACHE_TTL = int(os.getenv("STATS_CACHE_TTL", "300"))  # seconds
+
+# key -> (expires_at, value)
+_entries = {}
+# key -> future of the computation currently running for that key
+_inflight = {}
+# bumped on every invalidation so results computed before it are not stored
+_generation = 0
+
+
+def invalidate():
+    """Drop all cached reports; safe to call from any thread."""
+    global _generation
+    _generation += 1
+    _entries.clear()
+
+
+async def get_or_compute(key, compute, ttl: int = STATS_CACHE_TTL):
+    """Return the cached value for key, or run blocking `compute()` in a worker thread."""
+    entry = _entries.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+
+    pending = _inflight.get(key)
+    if pending is not None:
+        # shield: a cancelled waiter must not cancel the shared computation
+        return await asyncio.shield(pending)
+
+    generation = _generation
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        value = await asyncio.to_thread(compute)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved when nobody else was waiting
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+    if ttl > 0 and generation == _generation:
+        _entries[key] = (time.monotonic() + ttl, value)
+    future.set_result(value)
+    return value
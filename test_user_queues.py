@@ -0,0 +1,107 @@
+"""Ordering and cancellation of UserQueues.run.
+
+    python -m unittest test_user_queues
+"""
+import asyncio
+import unittest
+
+from user_queues import UserQueues
+
+
+class UserQueuesTest(unittest.IsolatedAsyncioTestCase):
+    async def test_same_key_runs_in_arrival_order(self):
+        queues = UserQueues()
+        log = []
+
+        async def call(name, delay):
+            log.append(f"{name} start")
+            await asyncio.sleep(delay)
+            log.append(f"{name} end")
+            return name
+
+        results = await asyncio.gather(
+            queues.run(1, lambda: call("a", 0.02)),
+            queues.run(1, lambda: call("b", 0)),
+            queues.run(1, lambda: call("c", 0.01)),
+        )
+        self.assertEqual(results, ["a", "b", "c"])
+        self.assertEqual(log, ["a start", "a end", "b start", "b end", "c start", "c end"])
+        self.assertEqual(len(queues), 0)
+
+    async def test_different_keys_run_in_parallel(self):
+        queues = UserQueues()
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def blocked():
+            started.set()
+            await release.wait()
+
+        first = asyncio.create_task(queues.run(1, blocked))
+        await started.wait()
+        # user 2 is not held up by user 1's unfinished call
+        self.assertEqual(await asyncio.wait_for(queues.run(2, lambda: asyncio.sleep(0, "done")), 1), "done")
+        release.set()
+        await first
+
+    async def test_worker_limit(self):
+        queues = UserQueues(workers=2)
+        running = peak = 0
+
+        async def call():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(queues.run(key, call) for key in range(6)))
+        self.assertEqual(peak, 2)
+
+    async def test_cancelled_waiter_is_skipped(self):
+        queues = UserQueues()
+        release = asyncio.Event()
+        log = []
+
+        async def head():
+            await release.wait()
+            return "head"
+
+        async def record(name):
+            log.append(name)
+
+        first = asyncio.create_task(queues.run(1, head))
+        second = asyncio.create_task(queues.run(1, lambda: record("second")))
+        third = asyncio.create_task(queues.run(1, lambda: record("third")))
+        await asyncio.sleep(0)
+        # the head finishes and the next waiter is cancelled in the same loop
+        # iteration: the head's cleanup sees the cancelled turn before the
+        # waiter's own cleanup has removed it
+        release.set()
+        second.cancel()
+        self.assertEqual(await first, "head")
+        with self.assertRaises(asyncio.CancelledError):
+            await second
+        await third
+        self.assertEqual(log, ["third"])
+        self.assertEqual(len(queues), 0)
+
+    async def test_cancelled_head_passes_the_turn(self):
+        queues = UserQueues()
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.Event().wait()
+
+        first = asyncio.create_task(queues.run(1, hang))
+        second = asyncio.create_task(queues.run(1, lambda: asyncio.sleep(0, "second")))
+        await started.wait()
+        first.cancel()
+        self.assertEqual(await asyncio.wait_for(second, 1), "second")
+        self.assertTrue(first.cancelled())
+        self.assertEqual(len(queues), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
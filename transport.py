@@ -0,0 +1,74 @@
+"""Bot API transport settings: connection pool, keep-alive, DNS cache, JSON codec, uvloop."""
+import asyncio
+import json
+import logging
+import os
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+# how many sends a broadcast keeps in flight; the pool is sized to match
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "16"))
+BROADCAST_RETRIES = 3  # resends of one message after Telegram's flood control (429)
+BOT_POOL_SIZE = int(os.getenv("BOT_POOL_SIZE", "0"))  # 0 = BROADCAST_CONCURRENCY + headroom
+POOL_HEADROOM = 4  # connections left for handler replies while a broadcast runs
+BOT_KEEPALIVE = float(os.getenv("BOT_KEEPALIVE", "75"))  # seconds idle connections are kept
+BOT_DNS_TTL = int(os.getenv("BOT_DNS_TTL", "3600"))  # seconds
+BOT_FAST_JSON = _env_flag("BOT_FAST_JSON", "1")
+BOT_UVLOOP = _env_flag("BOT_UVLOOP", "1")
+# alternative Bot API endpoint, e.g. a local Bot API server
+BOT_API_BASE = os.getenv("BOT_API_BASE")
+
+
+def pool_size() -> int:
+    return BOT_POOL_SIZE or BROADCAST_CONCURRENCY + POOL_HEADROOM
+
+
+def json_codec(fast: bool = BOT_FAST_JSON):
+    """(loads, dumps) pair; orjson when requested and installed, stdlib json otherwise."""
+    if fast:
+        try:
+            import orjson
+        except ImportError:
+            logging.info("orjson is not installed; using stdlib json for Bot API calls")
+        else:
+            return orjson.loads, lambda obj: orjson.dumps(obj).decode("utf-8")
+    return json.loads, json.dumps
+
+
+def build_session(
+    limit: int | None = None,
+    api_base: str | None = BOT_API_BASE,
+    fast_json: bool = BOT_FAST_JSON,
+) -> AiohttpSession:
+    limit = limit or pool_size()
+    loads, dumps = json_codec(fast_json)
+    kwargs = {"json_loads": loads, "json_dumps": dumps}
+    if api_base:
+        kwargs["api"] = TelegramAPIServer.from_base(api_base)
+    session = AiohttpSession(limit=limit, **kwargs)
+    # aiogram has no public hook for the remaining TCPConnector arguments
+    session._connector_init.update(
+        limit_per_host=limit,
+        keepalive_timeout=BOT_KEEPALIVE,
+        ttl_dns_cache=BOT_DNS_TTL,
+    )
+    return session
+
+
+def install_event_loop_policy(enabled: bool = BOT_UVLOOP) -> bool:
+    """Switch asyncio to uvloop when enabled and installed; call before asyncio.run."""
+    if not enabled:
+        return False
+    try:
+        import uvloop
+    except ImportError:
+        logging.info("uvloop is not installed; using the default asyncio event loop")
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
@@ -0,0 +1,59 @@
+"""Per-user ordered processing of updates.
+
+aiogram handles every update in its own task, so two quick taps from one user
+(adjust:+1 twice, level: then drink:) could interleave and overwrite each other.
+Updates are sharded by user id into FIFO queues: one user's updates run one at a
+time in arrival order, different users run in parallel, and at most
+UPDATE_WORKERS handlers run at once. A user's queue is evicted as soon as it
+drains, so idle users cost nothing.
+"""
+import asyncio
+import collections
+import os
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "32"))
+
+
+class UserQueues:
+    def __init__(self, workers: int = UPDATE_WORKERS):
+        self._queues = {}  # user_id -> deque of futures; the head one holds the turn
+        self._workers = asyncio.Semaphore(workers)
+
+    def __len__(self):
+        """Number of users with updates running or waiting."""
+        return len(self._queues)
+
+    async def run(self, key, call):
+        """Await `call()` once every earlier call for `key` has finished; None means no ordering."""
+        if key is None:
+            async with self._workers:
+                return await call()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = collections.deque()
+        turn = asyncio.get_running_loop().create_future()
+        queue.append(turn)
+        if len(queue) == 1:
+            turn.set_result(None)
+        try:
+            await turn
+            # waiting for the turn does not hold a worker slot
+            async with self._workers:
+                return await call()
+        finally:
+            queue.remove(turn)
+            if queue:
+                _pass_turn(queue)
+            elif self._queues.get(key) is queue:
+                del self._queues[key]
+
+
+def _pass_turn(queue):
+    """Give the turn to the first live waiter unless someone already holds it."""
+    for waiter in queue:
+        if not waiter.done():
+            waiter.set_result(None)
+            return
+        if not waiter.cancelled():
+            return  # this one holds the turn
+        # cancelled waiters remove themselves once their task unwinds